@@ -6,20 +6,50 @@
 #   ✅ Weekend premium detection
 #   ✅ Richer QuoteResponse with van_count, movers, breakdown
 #   ✅ Improved description with van info
+#
+# movco-storage-api/api.py carries verbatim copies of this file's shared
+# helpers (listed in tests/test_storage_api_sync.py). Change them here first,
+# then copy them across; the tests fail while the two copies disagree.
 
-from fastapi import FastAPI
+from fastapi import (
+    BackgroundTasks, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import joblib
-import requests
+import httpx
 import anthropic
+import asyncio
 import base64
+import contextvars
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
 import math
-from datetime import datetime
+import re
+import random
+import sqlite3
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 import os
+import time
 import traceback
+from collections import OrderedDict, defaultdict, deque
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it photos are sent as downloaded
+    Image = None
+    print("[MOVCO] WARNING: Pillow not installed - photos are sent to vision without "
+          "downscaling or recompression (pip install Pillow)")
 
 FT3_TO_M3 = 0.0283168  # cubic feet -> cubic metres
 
@@ -53,6 +83,195 @@ MIN_QUOTE = 200.0               # Absolute minimum quote (£)
 # ---------------------------------------------------------------------------
 MODEL_PATH = os.getenv("MOVCO_MODEL_PATH", "movco_model.joblib")
 
+# Max photos analysed at once per request (each one = image download + vision call).
+# These are coroutines on the event loop, not threads, so this only bounds
+# upstream fan-out per quote.
+PHOTO_ANALYSIS_CONCURRENCY = max(1, int(os.getenv("MOVCO_PHOTO_CONCURRENCY", "6")))
+
+# /analyze/stream sends an SSE comment this often while idle (keeps proxies happy)
+SSE_KEEPALIVE_SECONDS = float(os.getenv("MOVCO_SSE_KEEPALIVE_SECONDS", "15"))
+
+# How often /analyze checks whether the client has gone away
+DISCONNECT_POLL_SECONDS = float(os.getenv("MOVCO_DISCONNECT_POLL_SECONDS", "0.5"))
+
+# Vision request hedging (opt-in): duplicate a call that is slower than the
+# given percentile of recent latency, within a budget of extra calls
+VISION_HEDGE_ENABLED = os.getenv("MOVCO_VISION_HEDGE", "0") == "1"
+VISION_HEDGE_PERCENTILE = float(os.getenv("MOVCO_VISION_HEDGE_PERCENTILE", "95"))
+VISION_HEDGE_BUDGET_RATIO = float(os.getenv("MOVCO_VISION_HEDGE_BUDGET_RATIO", "0.05"))
+VISION_HEDGE_BUDGET_BURST = float(os.getenv("MOVCO_VISION_HEDGE_BUDGET_BURST", "3"))
+VISION_HEDGE_MIN_SAMPLES = 20
+VISION_LATENCY_WINDOW = 200      # recent successful vision calls kept for percentiles
+
+# Vision admission control: set the per-minute limits to your Anthropic rate-limit
+# tier. Calls over the limit queue for up to MAX_QUEUE_WAIT; /analyze answers
+# 503 + Retry-After once MAX_QUEUE callers are already waiting.
+VISION_REQUESTS_PER_MINUTE = float(os.getenv("MOVCO_VISION_RPM", "50"))
+VISION_INPUT_TOKENS_PER_MINUTE = float(os.getenv("MOVCO_VISION_INPUT_TPM", "40000"))
+VISION_MAX_QUEUE = int(os.getenv("MOVCO_VISION_MAX_QUEUE", "50"))
+VISION_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("MOVCO_VISION_MAX_QUEUE_WAIT_SECONDS", "10"))
+VISION_BURST_SECONDS = 10        # buckets hold ~10 s worth of the per-minute limits
+VISION_EST_INPUT_TOKENS = 1900   # ~1600 image tokens (API-resized photo) + prompt
+
+# Multi-image vision calls: photos reaching the vision step within BATCH_WAIT_MS
+# of each other (same traffic class) share one request of up to BATCH_SIZE
+# images, saving a round trip and the instruction prompt per photo. 1 = off.
+VISION_BATCH_SIZE = max(1, int(os.getenv("MOVCO_VISION_BATCH_SIZE", "1")))
+VISION_BATCH_WAIT_MS = float(os.getenv("MOVCO_VISION_BATCH_WAIT_MS", "50"))
+
+
+def parse_class_settings(raw: str) -> Dict[str, float]:
+    """'dashboard=8,public=3' -> {'dashboard': 8.0, 'public': 3.0}"""
+    settings = {}
+    for part in raw.split(","):
+        name, _, value = part.partition("=")
+        if name.strip():
+            settings[name.strip()] = float(value)
+    return settings
+
+
+# Traffic classes competing for vision capacity (X-Movco-Traffic-Class header).
+# Queued calls are served in proportion to WEIGHTS; a class is refused with 503
+# once the queue is SHED_AT x MAX_QUEUE deep, so low classes are shed first.
+# "background" is jobs, top-ups and re-analysis; unknown/missing means "public".
+# Any class but "public" is only granted to callers whose X-API-Key matches that
+# class's key in MOVCO_TRAFFIC_CLASS_KEYS ("dashboard=<key>"). The dashboard's
+# Next.js proxy (MOVCO_DASHBOARD_API_KEY) needs its key there and in
+# MOVCO_RATE_LIMIT_API_KEYS, or its users share one Vercel IP's allowance.
+TRAFFIC_CLASS_WEIGHTS = parse_class_settings(
+    os.getenv("MOVCO_TRAFFIC_WEIGHTS", "dashboard=8,public=4,background=1")
+)
+TRAFFIC_CLASS_SHED_AT = parse_class_settings(
+    os.getenv("MOVCO_TRAFFIC_SHED_AT", "dashboard=1.0,public=0.8,background=0.4")
+)
+DEFAULT_TRAFFIC_CLASS = "public"
+TRAFFIC_CLASS_KEYS = {
+    name.strip(): key.strip()
+    for name, _, key in (
+        part.partition("=") for part in os.getenv("MOVCO_TRAFFIC_CLASS_KEYS", "").split(",")
+    )
+    if name.strip() and key.strip()
+}
+
+# Load-aware quality tiers for /analyze: full → downscaled → sampled → catalogue.
+# Each list holds the three points at which the pipeline drops a tier: queue
+# depth as a fraction of the caller's shed depth, and recent p90 vision latency
+# (ignored once no call has finished for DEGRADE_LATENCY_STALE_SECONDS).
+QUALITY_TIERS = ("full", "downscaled", "sampled", "catalogue")
+DEGRADE_QUEUE_FRACTIONS = [
+    float(x) for x in os.getenv("MOVCO_DEGRADE_QUEUE_FRACTIONS", "0.3,0.6,0.9").split(",")
+]
+DEGRADE_P90_LATENCY_MS = [
+    float(x) for x in os.getenv("MOVCO_DEGRADE_P90_LATENCY_MS", "20000,30000,45000").split(",")
+]
+DEGRADE_LATENCY_STALE_SECONDS = 60.0
+DEGRADE_DOWNSCALE_EDGE_PX = int(os.getenv("MOVCO_DEGRADE_DOWNSCALE_EDGE_PX", "768"))
+DEGRADE_SAMPLE_FRACTION = float(os.getenv("MOVCO_DEGRADE_SAMPLE_FRACTION", "0.5"))
+
+# Circuit breakers (Google Maps, Anthropic): open when either rate is crossed
+# over the last BREAKER_WINDOW calls; stay open for BREAKER_OPEN_SECONDS
+BREAKER_WINDOW = int(os.getenv("MOVCO_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("MOVCO_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("MOVCO_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("MOVCO_BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("MOVCO_BREAKER_OPEN_SECONDS", "30"))
+MAPS_SLOW_CALL_MS = float(os.getenv("MOVCO_MAPS_SLOW_CALL_MS", "5000"))
+VISION_SLOW_CALL_MS = float(os.getenv("MOVCO_VISION_SLOW_CALL_MS", "45000"))
+
+# Retries for transient download / vision errors (per photo, full-jitter backoff)
+RETRY_MAX_ATTEMPTS = int(os.getenv("MOVCO_RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("MOVCO_RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("MOVCO_RETRY_MAX_DELAY_SECONDS", "4"))
+
+# Photos that still fail are re-analysed in the background from a durable queue
+REANALYSIS_POLL_SECONDS = float(os.getenv("MOVCO_REANALYSIS_POLL_SECONDS", "15"))
+REANALYSIS_MAX_ATTEMPTS = int(os.getenv("MOVCO_REANALYSIS_MAX_ATTEMPTS", "8"))
+REANALYSIS_BASE_DELAY_SECONDS = 30.0
+
+# Longest latency budget a caller may ask for in QuoteRequest.deadline_ms
+MAX_DEADLINE_MS = int(os.getenv("MOVCO_MAX_DEADLINE_MS", "120000"))
+
+# Idempotency-Key on /analyze: how long finished responses are replayable, and how many
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("MOVCO_IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("MOVCO_IDEMPOTENCY_MAX_ENTRIES", "1000"))
+
+# Per-client rate limits on the analyze endpoints, in photos per minute (each
+# request costs one token per photo). Set MOVCO_RATE_LIMIT_API_KEYS to
+# "key=photos_per_minute,..." to give known clients (X-API-Key) their own
+# allowance; everyone else is limited per IP. A keyed client that sends
+# X-Movco-Client-Id (the dashboard proxy sends the signed-in user's id) gets
+# that allowance per end user rather than one for all its traffic; the header
+# is ignored without a configured key. MOVCO_RATE_LIMIT_DB points all
+# workers at one SQLite file so they share buckets; unset = per-process memory.
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("MOVCO_RATE_LIMIT_IP_PER_MINUTE", "30"))
+RATE_LIMIT_IP_BURST = float(os.getenv("MOVCO_RATE_LIMIT_IP_BURST", "30"))
+RATE_LIMIT_API_KEYS = {
+    key.strip(): float(limit)
+    for key, _, limit in (
+        part.partition("=") for part in os.getenv("MOVCO_RATE_LIMIT_API_KEYS", "").split(",")
+    )
+    if key.strip()
+}
+RATE_LIMIT_DB_PATH = os.getenv("MOVCO_RATE_LIMIT_DB")
+# Proxies in front of us that append to X-Forwarded-For (Render: 1); 0 = use the socket peer
+TRUSTED_PROXY_HOPS = int(os.getenv("MOVCO_TRUSTED_PROXY_HOPS", "1"))
+
+# Speculative pre-analysis: the Supabase storage webhook calls POST /photos/ingest
+# as photos are uploaded, so /analyze mostly finds them downloaded and in the
+# vision cache. Callers must present MOVCO_INGEST_SECRET in X-Webhook-Secret
+# (unset = endpoint disabled). SUPABASE_URL turns storage object records into URLs.
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
+INGEST_WEBHOOK_SECRET = os.getenv("MOVCO_INGEST_SECRET")
+PREWARM_CONCURRENCY = max(1, int(os.getenv("MOVCO_PREWARM_CONCURRENCY", "2")))
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("MOVCO_IMAGE_CACHE_TTL_SECONDS", "900"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("MOVCO_IMAGE_CACHE_MAX_MB", "64"))
+
+# Photos are shrunk before vision: long edge (px; 1568 is where Claude itself
+# resizes, so there is no detection loss) and JPEG quality for the re-encode.
+# Photos already within the edge and under REENCODE_MIN_BYTES are sent as-is.
+IMAGE_MAX_EDGE_PX = int(os.getenv("MOVCO_IMAGE_MAX_EDGE_PX", "1568"))
+IMAGE_JPEG_QUALITY = int(os.getenv("MOVCO_IMAGE_JPEG_QUALITY", "85"))
+IMAGE_REENCODE_MIN_BYTES = int(os.getenv("MOVCO_IMAGE_REENCODE_MIN_KB", "500")) * 1024
+
+# Photo downloads are streamed: anything larger than this is abandoned mid-read
+MAX_IMAGE_BYTES = int(float(os.getenv("MOVCO_MAX_IMAGE_MB", "20")) * 1024 * 1024)
+IMAGE_CHUNK_BYTES = 64 * 1024
+
+# Opt-in (MOVCO_VISION_URL_SOURCE=1): public Supabase photos are handed to the
+# vision API as a URL to fetch itself, saving the download + base64 re-upload.
+# The trade-off: those photos skip our downscale/recompress and MAX_IMAGE_BYTES
+# cap, and are cached by URL rather than by content, so the same photo under
+# a new URL is analysed again. Signed/private URLs, or a URL the provider
+# can't fetch, always go through the download path.
+VISION_URL_SOURCE = os.getenv("MOVCO_VISION_URL_SOURCE", "0") == "1"
+
+# Persistent vision-result cache, content-addressed (image bytes + model + prompt).
+# Point both APIs at the same file to share it; MOVCO_ADMIN_TOKEN enables the
+# purge endpoint (X-Admin-Token).
+VISION_CACHE_DB_PATH = os.getenv("MOVCO_VISION_CACHE_DB", "movco_vision_cache.sqlite3")
+VISION_CACHE_TTL_SECONDS = float(os.getenv("MOVCO_VISION_CACHE_TTL_DAYS", "30")) * 86400
+VISION_CACHE_MAX_MB = float(os.getenv("MOVCO_VISION_CACHE_MAX_MB", "100"))
+ADMIN_TOKEN = os.getenv("MOVCO_ADMIN_TOKEN")
+
+# Direct uploads to /analyze_photo: size cap, and the Supabase Storage bucket a
+# copy is saved to after answering (needs SUPABASE_URL + SUPABASE_SERVICE_KEY;
+# unset = the photo isn't kept)
+MAX_UPLOAD_BYTES = int(float(os.getenv("MOVCO_MAX_UPLOAD_MB", "15")) * 1024 * 1024)
+UPLOAD_BUCKET = os.getenv("MOVCO_UPLOAD_BUCKET")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+
+# Background quote jobs (/analyze/jobs): SQLite file, worker count, retention
+QUOTE_JOBS_DB_PATH = os.getenv("MOVCO_JOBS_DB", "movco_jobs.sqlite3")
+QUOTE_JOB_WORKERS = max(1, int(os.getenv("MOVCO_JOB_WORKERS", "2")))
+QUOTE_JOB_RETENTION_SECONDS = float(os.getenv("MOVCO_JOB_RETENTION_HOURS", "168")) * 3600
+# Aggregated inventories kept (same SQLite file) so /quotes/{id}/reprice skips vision
+ANALYSIS_RETENTION_SECONDS = float(os.getenv("MOVCO_ANALYSIS_RETENTION_HOURS", "720")) * 3600
+
+# Volume assumed for a photo still pending at the deadline when no photo has
+# finished yet to average from, and per room in the catalogue tier
+# (~4.5 m³ — a typical furnished room)
+AVERAGE_PHOTO_VOLUME_FT3 = 160.0
+
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 if not ANTHROPIC_API_KEY:
     print("[MOVCO] WARNING: ANTHROPIC_API_KEY not set - furniture detection will fail")
@@ -73,10 +292,34 @@ except Exception as e:
     print(f"[MOVCO] ERROR loading model at '{MODEL_PATH}': {e}")
     raise
 
-app = FastAPI()
+# Initialize Anthropic client. SDK retries are off: retry_transient() owns the
+# retry policy so the breaker, limiter and metrics see every attempt.
+client = (
+    anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
+    if ANTHROPIC_API_KEY else None
+)
+
+# Shared async HTTP client (image downloads + Google Maps). One connection
+# pool for the whole process so hundreds of in-flight quotes reuse sockets.
+http_client = httpx.AsyncClient(
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+)
+
 
-# Initialize Anthropic client
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_job_workers()
+    reanalysis_task = asyncio.create_task(reanalysis_worker())
+    yield
+    reanalysis_task.cancel()
+    await stop_job_workers()
+    await http_client.aclose()
+    if client:
+        await client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS setup
 app.add_middleware(
@@ -94,6 +337,45 @@ app.add_middleware(
 )
 
 
+# ---------- Metrics ----------
+
+class Metrics:
+    """
+    In-process counters, gauges and timing summaries, served as JSON on
+    /metrics. Per worker process — not aggregated across workers.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, float] = {}
+        self.summaries: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, amount: float = 1.0) -> None:
+        self.counters[name] += amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        summary = self.summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "summaries": {
+                name: {**s, "avg": round(s["sum"] / s["count"], 2) if s["count"] else 0.0}
+                for name, s in self.summaries.items()
+            },
+        }
+
+
+metrics = Metrics()
+
+
 @app.get("/health")
 def health():
     return {
@@ -101,15 +383,25 @@ def health():
         "anthropic_configured": bool(ANTHROPIC_API_KEY),
         "google_maps_configured": bool(GOOGLE_MAPS_API_KEY),
         "model_loaded": model is not None,
+        "circuit_breakers": {
+            breaker.name: breaker.status() for breaker in (maps_breaker, vision_breaker)
+        },
     }
 
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+
 # ---------- Schemas ----------
 
 class QuoteRequest(BaseModel):
     starting_address: str
     ending_address: str
     photo_urls: List[str]
+    # Optional latency budget: return the best quote available by then
+    deadline_ms: Optional[int] = Field(None, ge=1, le=MAX_DEADLINE_MS)
 
 
 class AiItem(BaseModel):
@@ -132,8 +424,33 @@ class QuoteResponse(BaseModel):
     van_description: str = "1 × Large Van (Luton)"
     recommended_movers: int = 2
     is_weekend: bool = False
-    pricing_method: str = "hybrid"  # "model", "rule_based", or "hybrid"
+    pricing_method: str = "hybrid"  # "model", "rule_based", "hybrid", "calculated" or "calculated_<tier>"
     job_hours: float = 4.0
+    # Wall-clock time per pipeline stage (ms) + which input gated pricing
+    stage_timings_ms: Dict[str, float] = {}
+    critical_path: Optional[str] = None
+    # Photos that failed even after retries are re-analysed in the background;
+    # poll GET /analyze/jobs/{quote_id} for the updated quote
+    is_provisional: bool = False
+    failed_photo_urls: List[str] = []
+    quote_id: Optional[str] = None
+    # Deadline-limited quotes: which photos made it in, and where to get the rest
+    is_partial: bool = False
+    included_photo_urls: List[str] = []
+    pending_photo_urls: List[str] = []
+    estimated_pending_volume_ft3: float = 0.0
+    topup_job_id: Optional[str] = None
+    # Stored inventory: POST /quotes/{analysis_id}/reprice re-prices it without vision
+    analysis_id: Optional[str] = None
+
+
+class RepriceRequest(BaseModel):
+    # Anything left out keeps the value the analysis was priced with
+    starting_address: Optional[str] = None
+    ending_address: Optional[str] = None
+    move_date: Optional[date] = None
+    stairs_flights: Optional[int] = Field(None, ge=0)
+    movers: Optional[int] = Field(None, ge=1)
 
 
 FURNITURE_VOLUMES = {
@@ -484,13 +801,221 @@ def calculate_hybrid_price(
     return max(round(clamped, 2), MIN_QUOTE), "hybrid"
 
 
+# ---------- In-flight request coalescing ----------
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent upstream calls: while a call for `key`
+    is in flight, later callers await the same task instead of starting
+    their own. The shared call is cancelled only once every caller waiting
+    on it has gone away.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, Dict[str, Any]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(fn()), "waiters": 0}
+            self._calls[key] = entry
+            entry["task"].add_done_callback(lambda _: self._forget(key, entry))
+            metrics.incr(f"singleflight_{self.name}_calls")
+        else:
+            metrics.incr(f"singleflight_{self.name}_coalesced")
+        task = entry["task"]
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not task.done():
+                task.cancel()  # last interested caller left
+
+    def _forget(self, key: str, entry: Dict[str, Any]) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+
+def photo_flight_key(url: str) -> str:
+    return normalise_supabase_url(url.strip())
+
+
+def address_flight_key(start: str, end: str) -> str:
+    def norm(address: str) -> str:
+        return " ".join(address.lower().replace(",", " ").split())
+    return f"{norm(start)}|{norm(end)}"
+
+
+vision_flights = SingleFlight("vision")
+distance_flights = SingleFlight("distance")
+
+
+# ---------- Result caches ----------
+
+class TTLCache:
+    """
+    In-process LRU with expiry. Each entry has a size (1 by default, or e.g.
+    its byte length) and the least recently used entries are dropped once
+    the total passes `max_size`. Hits and misses are counted as
+    cache_<name>_hits / cache_<name>_misses.
+    """
+
+    def __init__(self, name: str, max_size: float, ttl_seconds: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.size = 0.0
+        self._entries: OrderedDict = OrderedDict()  # key -> (stored_at, size, value)
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                self._drop(key)
+            metrics.incr(f"cache_{self.name}_misses")
+            return None
+        self._entries.move_to_end(key)
+        metrics.incr(f"cache_{self.name}_hits")
+        return entry[2]
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and time.time() - entry[0] <= self.ttl_seconds
+
+    def put(self, key: str, value: Any, size: float = 1) -> None:
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.time(), size, value)
+        self.size += size
+        while self.size > self.max_size and self._entries:
+            self._drop(next(iter(self._entries)))
+        metrics.set_gauge(f"cache_{self.name}_size", self.size)
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def discard(self, key: str) -> None:
+        if key in self._entries:
+            self._drop(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0.0
+
+
+# Downloaded photos (base64, media type) by URL; sized in base64 chars. A photo
+# re-uploaded under the same path is dropped again by /photos/ingest.
+image_cache = TTLCache("image", IMAGE_CACHE_MAX_MB * 1024 * 1024, IMAGE_CACHE_TTL_SECONDS)
+
+
+# ---------- Circuit breakers ----------
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-upstream breaker over the last BREAKER_WINDOW calls.
+
+      closed    — calls flow; opens when the error rate or the slow-call
+                  rate crosses its threshold (after BREAKER_MIN_CALLS calls)
+      open      — calls are refused for BREAKER_OPEN_SECONDS so callers go
+                  straight to their fallback instead of waiting out timeouts
+      half_open — one probe call at a time; success closes the breaker,
+                  failure (or a slow call) opens it again
+    """
+
+    def __init__(self, name: str, slow_call_ms: float):
+        self.name = name
+        self.slow_call_ms = slow_call_ms
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.outcomes: deque = deque(maxlen=BREAKER_WINDOW)  # (failed, slow)
+
+    def _rates(self) -> tuple[float, float]:
+        if not self.outcomes:
+            return 0.0, 0.0
+        failed = sum(1 for f, _ in self.outcomes if f) / len(self.outcomes)
+        slow = sum(1 for _, s in self.outcomes if s) / len(self.outcomes)
+        return failed, slow
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+        metrics.incr(f"breaker_{self.name}_opened")
+        print(f"[MOVCO] 🔌 Circuit breaker '{self.name}' OPEN for {BREAKER_OPEN_SECONDS:.0f}s")
+
+    def is_open(self) -> bool:
+        return self.state == "open" and time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now. Refusals are counted."""
+        if self.state == "open" and not self.is_open():
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        metrics.incr(f"breaker_{self.name}_short_circuited")
+        return False
+
+    def release_probe(self) -> None:
+        """A probe ended without a verdict (cancelled, rate-limited): let another through."""
+        self.probe_in_flight = False
+
+    def record(self, success: bool, latency_ms: float) -> None:
+        slow = latency_ms >= self.slow_call_ms
+        if self.state == "half_open":
+            if success and not slow:
+                print(f"[MOVCO] 🔌 Circuit breaker '{self.name}' closed again")
+                self.state = "closed"
+                self.probe_in_flight = False
+                self.outcomes.clear()
+            else:
+                self._open()
+            return
+        self.outcomes.append((not success, slow))
+        if self.state == "closed" and len(self.outcomes) >= BREAKER_MIN_CALLS:
+            failed, slow_rate = self._rates()
+            if failed >= BREAKER_FAILURE_RATE or slow_rate >= BREAKER_SLOW_CALL_RATE:
+                self._open()
+
+    def status(self) -> Dict[str, Any]:
+        failed, slow = self._rates()
+        info: Dict[str, Any] = {
+            "state": "half_open" if self.state == "open" and not self.is_open() else self.state,
+            "recent_calls": len(self.outcomes),
+            "error_rate": round(failed, 2),
+            "slow_call_rate": round(slow, 2),
+        }
+        if self.is_open():
+            info["retry_in_seconds"] = round(BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at), 1)
+        return info
+
+
+maps_breaker = CircuitBreaker("google_maps", MAPS_SLOW_CALL_MS)
+vision_breaker = CircuitBreaker("anthropic", VISION_SLOW_CALL_MS)
+
+
 # ---------- Google Maps Distance ----------
 
-def get_google_maps_distance(start: str, end: str) -> Dict[str, Any]:
+async def get_google_maps_distance(start: str, end: str) -> Dict[str, Any]:
     if not GOOGLE_MAPS_API_KEY:
         print("[MOVCO] ⚠️  No Google Maps API key - using fallback distance")
         return fallback_distance(start, end)
 
+    if not maps_breaker.allow():
+        print("[MOVCO] 🔌 Google Maps circuit open - using fallback distance")
+        return fallback_distance(start, end)
+
+    started = time.perf_counter()
     try:
         url = "https://maps.googleapis.com/maps/api/distancematrix/json"
         params = {
@@ -506,10 +1031,13 @@ def get_google_maps_distance(start: str, end: str) -> Dict[str, Any]:
         print(f"[MOVCO]    From: {start}")
         print(f"[MOVCO]    To: {end}")
 
-        resp = requests.get(url, params=params, timeout=10)
+        resp = await http_client.get(url, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
 
+        # Any top-level status other than OK (quota, denied, unknown error) is
+        # an upstream problem; a route-level miss below is not.
+        maps_breaker.record(data.get("status") == "OK", (time.perf_counter() - started) * 1000)
         if data.get("status") != "OK":
             print(f"[MOVCO] ⚠️  Google Maps API error: {data.get('status')}")
             return fallback_distance(start, end)
@@ -537,7 +1065,11 @@ def get_google_maps_distance(start: str, end: str) -> Dict[str, Any]:
             "source": "google_maps",
         }
 
+    except asyncio.CancelledError:
+        maps_breaker.release_probe()
+        raise
     except Exception as e:
+        maps_breaker.record(False, (time.perf_counter() - started) * 1000)
         print(f"[MOVCO] ❌ Google Maps API error: {e}")
         traceback.print_exc()
         return fallback_distance(start, end)
@@ -569,50 +1101,535 @@ def normalise_supabase_url(url: str) -> str:
     return url
 
 
-def download_image_as_base64(url: str) -> tuple[str, str]:
+def direct_image_url(url: Optional[str]) -> Optional[str]:
+    """The URL itself if the vision API can fetch it directly (public Supabase object), else None."""
+    if not VISION_URL_SOURCE or not url or not url.startswith("https://"):
+        return None
+    if "/storage/v1/object/public/" not in url:
+        return None
+    if SUPABASE_URL and not url.startswith(SUPABASE_URL + "/"):
+        return None
+    return url
+
+
+class ImageRejected(ValueError):
+    """A photo URL that doesn't serve an acceptable image (too big, or not an image at all)."""
+
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+# Types that say nothing about the content (S3 and some CDNs label every
+# upload like this); the magic bytes decide instead
+GENERIC_CONTENT_TYPES = ("application/octet-stream", "binary/octet-stream")
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Media type from the file's magic bytes, or None for anything vision can't take."""
+    for signature, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def download_image_as_base64(url: str) -> tuple[str, str]:
+    """Stream the photo straight into its base64 form.
+
+    The body is read in chunks and encoded as it arrives into one buffer (sized
+    up front from Content-Length when the server sends it), so a photo is never
+    held as raw bytes, encoded bytes and a string all at once. Anything over
+    MAX_IMAGE_BYTES, or not an image, is rejected before the rest is read.
+    """
     fixed_url = normalise_supabase_url(url)
     print(f"[MOVCO] 📥 Downloading image from: {fixed_url[:80]}...")
-    resp = requests.get(fixed_url, timeout=15)
-    resp.raise_for_status()
-    content_type = resp.headers.get("content-type", "image/jpeg")
-    if "png" in content_type:
-        media_type = "image/png"
-    elif "webp" in content_type:
-        media_type = "image/webp"
-    elif "gif" in content_type:
-        media_type = "image/gif"
+    async with http_client.stream("GET", fixed_url, timeout=15) as resp:
+        resp.raise_for_status()
+        content_type = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type and not content_type.startswith("image/") and content_type not in GENERIC_CONTENT_TYPES:
+            raise ImageRejected(f"Not an image ({content_type})")
+        declared = int(resp.headers.get("content-length") or 0)
+        if declared > MAX_IMAGE_BYTES:
+            raise ImageRejected(f"Image is {declared} bytes (limit {MAX_IMAGE_BYTES})")
+
+        encoded = bytearray(4 * math.ceil(declared / 3))
+        written = received = 0
+        media_type = None
+        carry = b""
+        async for chunk in resp.aiter_bytes(IMAGE_CHUNK_BYTES):
+            received += len(chunk)
+            if received > MAX_IMAGE_BYTES:
+                raise ImageRejected(f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+            if carry:
+                chunk = carry + chunk
+            if media_type is None:
+                if len(chunk) < 12:
+                    carry = chunk
+                    continue
+                media_type = sniff_image_type(chunk[:12])
+                if media_type is None:
+                    raise ImageRejected("Not a JPEG, PNG, GIF or WebP image")
+            # base64 works in 3-byte groups; hold back the remainder for the next chunk
+            whole = len(chunk) - len(chunk) % 3
+            carry = chunk[whole:]
+            piece = base64.b64encode(chunk[:whole])
+            encoded[written:written + len(piece)] = piece
+            written += len(piece)
+
+    if media_type is None:
+        if not carry:
+            raise ImageRejected("Empty image")
+        media_type = sniff_image_type(carry[:12])
+        if media_type is None:
+            raise ImageRejected("Not a JPEG, PNG, GIF or WebP image")
+    if carry:
+        piece = base64.b64encode(carry)
+        encoded[written:written + len(piece)] = piece
+        written += len(piece)
+    del encoded[written:]
+    base64_image = encoded.decode("ascii")
+    print(f"[MOVCO] ✓ Image downloaded ({received} bytes, {media_type})")
+    return base64_image, media_type
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Claude's image token estimate (w*h/750) after its own resize to a 1568 px long edge."""
+    scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+    return int(width * scale * height * scale / 750)
+
+
+def preprocess_image(
+    base64_image: str, media_type: str, max_edge: int
+) -> tuple[str, str, Dict[str, int]]:
+    """
+    Shrink a photo before it goes to vision: JPEG draft-mode decode (decodes
+    at 1/2, 1/4 or 1/8 scale directly), EXIF orientation applied, long edge
+    resized to `max_edge`, re-encoded as JPEG at IMAGE_JPEG_QUALITY. The
+    original is kept if that wouldn't make it smaller. Returns the image plus
+    bytes/tokens before and after.
+    """
+    data = base64.b64decode(base64_image)
+    if Image is None or media_type == "image/gif":
+        return base64_image, media_type, {}
+    img = Image.open(io.BytesIO(data))
+    before_size = img.size
+    orientation = img.getexif().get(0x0112, 1)  # EXIF Orientation tag; 1 = upright
+    if max(img.size) <= max_edge and orientation == 1 and len(data) <= IMAGE_REENCODE_MIN_BYTES:
+        tokens = estimate_image_tokens(*before_size)
+        return base64_image, media_type, {
+            "bytes_before": len(data), "bytes_after": len(data),
+            "tokens_before": tokens, "tokens_after": tokens,
+        }
+    img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    processed = out.getvalue()
+    if len(processed) >= len(data) and orientation == 1:
+        processed, media_type_after = data, media_type
+        after_size = before_size
     else:
-        media_type = "image/jpeg"
-    base64_image = base64.b64encode(resp.content).decode("utf-8")
-    print(f"[MOVCO] ✓ Image downloaded ({len(base64_image)} chars, {media_type})")
+        media_type_after = "image/jpeg"
+        after_size = img.size
+    savings = {
+        "bytes_before": len(data),
+        "bytes_after": len(processed),
+        "tokens_before": estimate_image_tokens(*before_size),
+        "tokens_after": estimate_image_tokens(*after_size),
+    }
+    metrics.incr("image_bytes_saved", savings["bytes_before"] - savings["bytes_after"])
+    metrics.incr("image_tokens_saved", savings["tokens_before"] - savings["tokens_after"])
+    return base64.b64encode(processed).decode("utf-8"), media_type_after, savings
+
+
+async def load_image(url: str) -> tuple[str, str]:
+    """download_image_as_base64, served from image_cache when the photo was pre-fetched."""
+    key = photo_flight_key(url)
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+    base64_image, media_type = await download_image_as_base64(url)
+    image_cache.put(key, (base64_image, media_type), len(base64_image))
     return base64_image, media_type
 
 
-def analyze_room_with_claude(image_url: str) -> Dict[str, Any]:
-    if not client:
-        print("[MOVCO] ❌ Anthropic client not initialized")
-        return {"items": [], "total_volume_ft3": 0.0}
+# ---------- Vision admission control ----------
+
+class VisionCapacityError(Exception):
+    """Vision capacity exhausted; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Vision capacity exhausted, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# Traffic class of the quote being worked on. Set once per request (or job
+# worker); photo tasks inherit it, so the limiter can read it at the call site.
+traffic_class: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "traffic_class", default=DEFAULT_TRAFFIC_CLASS
+)
+
+
+def resolve_traffic_class(header_value: Optional[str], api_key: Optional[str]) -> str:
+    """The requested class if the caller's API key entitles it to that class, else "public"."""
+    name = (header_value or "").strip().lower()
+    if name not in TRAFFIC_CLASS_WEIGHTS or name == DEFAULT_TRAFFIC_CLASS:
+        return DEFAULT_TRAFFIC_CLASS
+    class_key = TRAFFIC_CLASS_KEYS.get(name)
+    if class_key and api_key and hmac.compare_digest(api_key, class_key):
+        return name
+    metrics.incr("traffic_class_unverified")
+    return DEFAULT_TRAFFIC_CLASS
+
+
+class VisionRateLimiter:
+    """
+    Process-wide token buckets for vision requests and input tokens, sized
+    from the provider's per-minute limits. Callers queue until both buckets
+    have room; if the queue is already at their class's shed depth, or the
+    wait would exceed MAX_WAIT, they get VisionCapacityError instead.
+
+    The queue is weighted-fair across traffic classes: each waiter is tagged
+    with its class's virtual finish time (previous tag + 1/weight) and the
+    lowest tag goes next, so under contention a class with weight 8 is served
+    about 8 times as often as one with weight 1, and no class starves.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        input_tokens_per_minute: float,
+        max_queue: int,
+        max_wait_seconds: float,
+    ):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = input_tokens_per_minute / 60
+        self.request_capacity = max(1.0, self.request_rate * VISION_BURST_SECONDS)
+        self.token_capacity = max(
+            float(VISION_EST_INPUT_TOKENS * VISION_BATCH_SIZE), self.token_rate * VISION_BURST_SECONDS
+        )
+        self.request_tokens = self.request_capacity
+        self.input_tokens = self.token_capacity
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.waiting = 0
+        self.waiting_by_class: Dict[str, int] = defaultdict(int)
+        self._updated = time.monotonic()
+        self._queue: List[tuple] = []  # heap of (virtual finish tag, seq)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = defaultdict(float)
+        self._turn = asyncio.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self.request_tokens = min(self.request_capacity, self.request_tokens + elapsed * self.request_rate)
+        self.input_tokens = min(self.token_capacity, self.input_tokens + elapsed * self.token_rate)
+
+    def _seconds_until_available(self, tokens: float) -> float:
+        return max(
+            (1.0 - self.request_tokens) / self.request_rate,
+            (tokens - self.input_tokens) / self.token_rate,
+            0.0,
+        )
+
+    def retry_after(self) -> float:
+        per_call = max(1 / self.request_rate, VISION_EST_INPUT_TOKENS / self.token_rate)
+        return max(1.0, math.ceil((self.waiting + 1) * per_call))
+
+    def check_admission(self) -> None:
+        """Reject up front (before any image download) if the queue is full for this class."""
+        cls = traffic_class.get()
+        if self.waiting >= self.max_queue * TRAFFIC_CLASS_SHED_AT.get(cls, 1.0):
+            metrics.incr("vision_admission_rejected")
+            metrics.incr(f"vision_admission_rejected_{cls}")
+            raise VisionCapacityError(self.retry_after())
+
+    def try_acquire_now(self, tokens: float) -> bool:
+        self._refill()
+        if self.waiting or self._seconds_until_available(tokens) > 0:
+            return False
+        self.request_tokens -= 1
+        self.input_tokens -= tokens
+        return True
+
+    def _set_depth_gauges(self, cls: str) -> None:
+        metrics.set_gauge("vision_queue_depth", self.waiting)
+        metrics.set_gauge(f"vision_queue_depth_{cls}", self.waiting_by_class[cls])
+
+    async def acquire(self, tokens: float) -> None:
+        self.check_admission()
+        cls = traffic_class.get()
+        tag = max(self._virtual_time, self._last_tag[cls]) + 1 / TRAFFIC_CLASS_WEIGHTS.get(cls, 1.0)
+        self._last_tag[cls] = tag
+        ticket = (tag, next(self._seq))
+        self.waiting += 1
+        self.waiting_by_class[cls] += 1
+        self._set_depth_gauges(cls)
+        started = time.monotonic()
+        try:
+            async with self._turn:
+                heapq.heappush(self._queue, ticket)
+                self._turn.notify_all()  # a new head may have to take over
+                try:
+                    while True:
+                        if self._queue[0] != ticket:
+                            await self._turn.wait()
+                            continue
+                        self._refill()
+                        wait = self._seconds_until_available(tokens)
+                        if wait <= 0:
+                            break
+                        if time.monotonic() - started + wait > self.max_wait_seconds:
+                            metrics.incr("vision_queue_timeouts")
+                            raise VisionCapacityError(self.retry_after())
+                        # Sleep for the refill, but wake if a higher-priority waiter arrives
+                        try:
+                            await asyncio.wait_for(self._turn.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+                    self.request_tokens -= 1
+                    self.input_tokens -= tokens
+                    self._virtual_time = max(self._virtual_time, tag)
+                finally:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._turn.notify_all()
+        finally:
+            self.waiting -= 1
+            self.waiting_by_class[cls] -= 1
+            self._set_depth_gauges(cls)
+            waited_ms = (time.monotonic() - started) * 1000
+            metrics.observe("vision_queue_wait_ms", waited_ms)
+            metrics.observe(f"vision_queue_wait_ms_{cls}", waited_ms)
+
+    def settle(self, estimated_tokens: float, actual_tokens: float) -> None:
+        """Correct the input-token bucket once the real usage is known."""
+        self.input_tokens -= actual_tokens - estimated_tokens
+
+
+vision_limiter = VisionRateLimiter(
+    VISION_REQUESTS_PER_MINUTE,
+    VISION_INPUT_TOKENS_PER_MINUTE,
+    VISION_MAX_QUEUE,
+    VISION_MAX_QUEUE_WAIT_SECONDS,
+)
+
+
+# ---------- Vision request hedging ----------
+
+class VisionHedger:
+    """
+    Tracks recent vision-call latency and decides when to hedge: if a call
+    is still running after the configured percentile of recent latencies,
+    a duplicate is fired and whichever answers first wins.
+
+    Extra spend is capped by a token budget: every primary call earns
+    VISION_HEDGE_BUDGET_RATIO tokens (capped at VISION_HEDGE_BUDGET_BURST)
+    and every hedge spends one, so hedges stay at roughly that fraction of
+    traffic over time.
+    """
+
+    def __init__(self, percentile: float, budget_ratio: float, budget_burst: float):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self.budget = budget_burst
+        self.latencies_ms: deque = deque(maxlen=VISION_LATENCY_WINDOW)
+        self.last_recorded = 0.0
+
+    def record(self, latency_ms: float) -> None:
+        self.latencies_ms.append(latency_ms)
+        self.last_recorded = time.monotonic()
+        metrics.observe("vision_latency_ms", latency_ms)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Recent vision latency (ms) at `percentile`, or None until enough are observed."""
+        if len(self.latencies_ms) < VISION_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies_ms)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def hedge_delay_seconds(self) -> Optional[float]:
+        """Delay before hedging, or None until enough latencies are observed."""
+        delay_ms = self.latency_percentile(self.percentile)
+        if delay_ms is None:
+            return None
+        metrics.set_gauge("vision_hedge_delay_ms", round(delay_ms, 1))
+        return delay_ms / 1000
+
+    def earn(self) -> None:
+        self.budget = min(self.budget_burst, self.budget + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        if self.budget < 1.0:
+            metrics.incr("vision_hedges_skipped_budget")
+            return False
+        self.budget -= 1.0
+        return True
+
+
+vision_hedger = VisionHedger(
+    VISION_HEDGE_PERCENTILE,
+    VISION_HEDGE_BUDGET_RATIO,
+    VISION_HEDGE_BUDGET_BURST,
+)
+
+
+async def timed_vision_call(estimated_tokens: float, **kwargs) -> tuple[Any, float]:
+    if not vision_breaker.allow():
+        raise CircuitOpenError(vision_breaker.name)
+    started = time.perf_counter()
     try:
-        base64_image, media_type = download_image_as_base64(image_url)
-        print(f"[MOVCO] 🤖 Sending image to Claude Vision API...")
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2048,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": base64_image,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyze this room photo for a moving/removals company.
+        message = await client.messages.create(**kwargs)
+    except asyncio.CancelledError:
+        vision_breaker.release_probe()
+        raise
+    except anthropic.BadRequestError:
+        # Our request was at fault (e.g. an image URL it couldn't fetch), not the provider
+        vision_breaker.release_probe()
+        raise
+    except anthropic.RateLimitError as e:
+        vision_breaker.release_probe()
+        # Provider said 429 despite our limiter: surface it rather than
+        # quoting from an empty inventory
+        metrics.incr("vision_upstream_rate_limited")
+        try:
+            retry_after = float(e.response.headers.get("retry-after", ""))
+        except ValueError:
+            retry_after = vision_limiter.retry_after()
+        raise VisionCapacityError(retry_after) from e
+    except Exception:
+        vision_breaker.record(False, (time.perf_counter() - started) * 1000)
+        raise
+    vision_breaker.record(True, (time.perf_counter() - started) * 1000)
+    vision_limiter.settle(estimated_tokens, message.usage.input_tokens)
+    return message, (time.perf_counter() - started) * 1000
+
+
+async def create_vision_message(estimated_tokens: float = VISION_EST_INPUT_TOKENS, **kwargs) -> Any:
+    """
+    client.messages.create with optional hedging (MOVCO_VISION_HEDGE=1).
+    Latency of every successful call feeds the hedge threshold either way.
+    """
+    await vision_limiter.acquire(estimated_tokens)
+    metrics.incr("vision_calls")
+    vision_hedger.earn()
+    primary = asyncio.create_task(timed_vision_call(estimated_tokens, **kwargs))
+    tasks = {primary}
+    try:
+        delay = vision_hedger.hedge_delay_seconds() if VISION_HEDGE_ENABLED else None
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if (
+                not done
+                and vision_hedger.try_spend()
+                and vision_limiter.try_acquire_now(estimated_tokens)
+            ):
+                print(f"[MOVCO] 🪃 Vision call slower than p{VISION_HEDGE_PERCENTILE:g} "
+                      f"({delay * 1000:.0f} ms) — sending hedge request")
+                metrics.incr("vision_hedges_fired")
+                tasks.add(asyncio.create_task(timed_vision_call(estimated_tokens, **kwargs)))
+
+        # First successful answer wins; only fail if every attempt failed
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                message, latency_ms = task.result()
+                vision_hedger.record(latency_ms)
+                if task is not primary:
+                    metrics.incr("vision_hedge_wins")
+                return message
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        calls = metrics.counters["vision_calls"]
+        metrics.set_gauge("vision_hedge_rate", round(metrics.counters["vision_hedges_fired"] / calls, 4))
+
+
+# ---------- Load-aware quality tiers ----------
+
+def choose_quality_tier() -> str:
+    """
+    Pick the quality tier for a new quote from the live queue depth (relative
+    to the caller's traffic class, so lower classes degrade first) and recent
+    vision latency. The worse of the two signals wins.
+    """
+    shed_depth = vision_limiter.max_queue * TRAFFIC_CLASS_SHED_AT.get(traffic_class.get(), 1.0)
+    queue_load = vision_limiter.waiting / shed_depth if shed_depth else 1.0
+    p90_ms = vision_hedger.latency_percentile(90)
+    if p90_ms is None or time.monotonic() - vision_hedger.last_recorded > DEGRADE_LATENCY_STALE_SECONDS:
+        p90_ms = 0.0
+    level = max(
+        sum(queue_load >= t for t in DEGRADE_QUEUE_FRACTIONS),
+        sum(p90_ms >= t for t in DEGRADE_P90_LATENCY_MS),
+    )
+    tier = QUALITY_TIERS[min(level, len(QUALITY_TIERS) - 1)]
+    metrics.incr(f"quality_tier_{tier}")
+    return tier
+
+
+def sample_photo_indices(total: int, fraction: float) -> List[int]:
+    """Evenly spaced 1-based photo indices covering `fraction` of the photos (at least one)."""
+    count = min(total, max(1, math.ceil(total * fraction)))
+    return sorted({1 + int(i * total / count) for i in range(count)})
+
+
+# ---------- Retries ----------
+
+def is_transient_error(e: BaseException) -> bool:
+    """Network trouble, timeouts and 5xx from either upstream are worth retrying."""
+    if isinstance(e, (httpx.TransportError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    if isinstance(e, anthropic.APIStatusError):
+        return e.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff for the given 1-based attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def retry_transient(fn: Callable[[], Awaitable[Any]], what: str) -> Any:
+    """Await fn(), retrying transient errors up to RETRY_MAX_ATTEMPTS times in total."""
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == RETRY_MAX_ATTEMPTS or not is_transient_error(e):
+                raise
+            delay = backoff_delay(attempt, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS)
+            print(f"[MOVCO] 🔁 {what} failed ({e}); retry {attempt}/{RETRY_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            metrics.incr("transient_retries")
+            await asyncio.sleep(delay)
+
+
+def failed_photo_result(error: str) -> Dict[str, Any]:
+    """Empty result for a photo we couldn't analyse (queued for re-analysis)."""
+    return {"items": [], "total_volume_ft3": 0.0, "failed": True, "error": error}
+
+
+# ---------- Persistent vision result cache ----------
+
+VISION_MODEL = "claude-sonnet-4-20250514"
+VISION_PROMPT = """Analyze this room photo for a moving/removals company.
 
 Identify ALL furniture and items visible. Use ONLY simple standard names from this list where possible:
 sofa, 2-seater sofa, 3-seater sofa, armchair, bed, single bed, double bed, king bed, mattress, wardrobe, chest of drawers, bedside table, nightstand, dining table, dining chair, coffee table, desk, office chair, bookcase, bookshelf, tv, tv stand, sideboard, cabinet, washing machine, fridge, dishwasher, microwave, boxes, lamp, floor lamp, mirror, rug, plant, bicycle, treadmill, printer, monitor, curtains, headboard, dresser
@@ -629,49 +1646,487 @@ Format your response EXACTLY as:
 - curtains (1)
 
 Count everything visible that would need to be moved or stored."""
-                        },
-                    ],
-                }
-            ],
+# Changes to the prompt change the version, so stale answers are never reused.
+# Bump VISION_PROMPT_LAYOUT when the prompt moves within the request (e.g. to a
+# system block): same text, different model input. Layout 2 retires answers
+# cached while the prompt was briefly sent as a system block.
+VISION_PROMPT_LAYOUT = 2
+VISION_PROMPT_VERSION = hashlib.sha256(
+    f"{VISION_PROMPT_LAYOUT}:{VISION_PROMPT}".encode()
+).hexdigest()[:12]
+
+
+class VisionCache:
+    """
+    SQLite cache of parsed vision answers ([{"label", "quantity"}]) keyed by
+    sha256(image bytes) + model + prompt version (or of the public URL, for
+    photos the provider fetched itself), so the same photo is only
+    analysed once however it reaches us. Volumes are not stored: they are
+    re-derived from FURNITURE_VOLUMES on every hit. Entries expire after
+    VISION_CACHE_TTL_SECONDS; past VISION_CACHE_MAX_MB the least recently
+    used go first.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS vision_cache (
+                    key TEXT PRIMARY KEY,
+                    result_json TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def key_for(base64_image: str, max_edge: Optional[int]) -> str:
+        digest = hashlib.sha256(base64.b64decode(base64_image)).hexdigest()
+        return f"{digest}:{VISION_MODEL}:{VISION_PROMPT_VERSION}:{max_edge or 'full'}"
+
+    @staticmethod
+    def key_for_url(url: str) -> str:
+        """Key for a photo the provider fetched by URL (never downloaded, so no bytes to hash)."""
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return f"url:{digest}:{VISION_MODEL}:{VISION_PROMPT_VERSION}:full"
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result_json FROM vision_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE vision_cache SET last_used_at = ? WHERE key = ?", (now, key)
+                )
+        metrics.incr("vision_cache_hits" if row else "vision_cache_misses")
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, parsed: List[Dict[str, Any]]) -> None:
+        result_json = json.dumps(parsed)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vision_cache VALUES (?, ?, ?, ?, ?)",
+                (key, result_json, len(result_json), now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 1:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        evicted = self._conn.execute(
+            "DELETE FROM vision_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM vision_cache").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used rows until ~10% under the cap
+            excess = total - self.max_bytes * 0.9
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM vision_cache ORDER BY last_used_at"
+            ).fetchall():
+                if excess <= 0:
+                    break
+                self._conn.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+                excess -= size
+                total -= size
+                evicted += 1
+        metrics.incr("vision_cache_evictions", evicted)
+        metrics.set_gauge("vision_cache_bytes", total)
+
+    def discard(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+
+    def purge(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM vision_cache").rowcount
+
+
+vision_cache = VisionCache(VISION_CACHE_DB_PATH, VISION_CACHE_TTL_SECONDS, VISION_CACHE_MAX_MB * 1024 * 1024)
+
+
+def parse_vision_items(response_text: str) -> List[Dict[str, Any]]:
+    """'- double bed (1)' lines -> [{"label": "double bed", "quantity": 1}, ...]"""
+    parsed = []
+    for line in response_text.split("\n"):
+        line = line.strip()
+        if not line or not line.startswith("-"):
+            continue
+        line = line[1:].strip()
+        if "(" in line and ")" in line:
+            item_name = line[: line.rfind("(")].strip()
+            quantity_str = line[line.rfind("(") + 1 : line.rfind(")")].strip()
+            try:
+                quantity = int(quantity_str)
+            except Exception:
+                quantity = 1
+        else:
+            item_name = line
+            quantity = 1
+        parsed.append({"label": item_name, "quantity": quantity})
+    return parsed
+
+
+def size_vision_items(parsed: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], float]:
+    """Attach volumes from FURNITURE_VOLUMES; returns (items, total_volume_ft3)."""
+    items = []
+    total_volume_ft3 = 0.0
+    for entry in parsed:
+        item_volume = estimate_item_volume(entry["label"]) * entry["quantity"]
+        items.append(
+            {
+                "label": entry["label"],
+                "quantity": entry["quantity"],
+                "volume_ft3": round(item_volume, 2),
+            }
         )
-        response_text = message.content[0].text
-        print(f"[MOVCO] 🤖 Claude response:\n{response_text}\n")
+        total_volume_ft3 += item_volume
+    return items, total_volume_ft3
 
-        items = []
-        total_volume_ft3 = 0.0
-        for line in response_text.split("\n"):
-            line = line.strip()
-            if not line or not line.startswith("-"):
-                continue
-            line = line[1:].strip()
-            if "(" in line and ")" in line:
-                item_name = line[: line.rfind("(")].strip()
-                quantity_str = line[line.rfind("(") + 1 : line.rfind(")")].strip()
-                try:
-                    quantity = int(quantity_str)
-                except Exception:
-                    quantity = 1
+
+def vision_request(source: Dict[str, str]) -> Dict[str, Any]:
+    """messages.create arguments for one photo, given its image source block."""
+    return dict(
+        model=VISION_MODEL,
+        max_tokens=2048,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "source": source},
+                    {"type": "text", "text": VISION_PROMPT},
+                ],
+            }
+        ],
+    )
+
+
+# ---------- Multi-image vision calls ----------
+
+VISION_BATCH_INSTRUCTIONS = """There are {count} photos above, each introduced by its "Photo N:" label.
+Apply the instructions above to each photo separately; never merge items from different photos.
+Start each photo's list with a heading line "## Photo N", in order, then that photo's items in the format above."""
+
+BATCH_HEADING = re.compile(r"^[#*\s]*photo\s+(\d+)\s*[:*]*\s*$", re.IGNORECASE)
+
+
+def batch_vision_request(sources: List[Dict[str, str]]) -> Dict[str, Any]:
+    """messages.create arguments for several photos answered in one call."""
+    content: List[Dict[str, Any]] = []
+    for number, source in enumerate(sources, 1):
+        content.append({"type": "text", "text": f"Photo {number}:"})
+        content.append({"type": "image", "source": source})
+    content.append({"type": "text", "text": VISION_PROMPT})
+    content.append({"type": "text", "text": VISION_BATCH_INSTRUCTIONS.format(count=len(sources))})
+    return dict(
+        model=VISION_MODEL,
+        max_tokens=2048 * len(sources),
+        messages=[{"role": "user", "content": content}],
+    )
+
+
+def split_batch_response(response_text: str, count: int) -> Optional[Dict[int, str]]:
+    """
+    '## Photo N' sections of a batched answer -> {N: that photo's lines}, in
+    any order; photos without a section are absent. None when the numbering
+    can't be trusted (a photo numbered twice or beyond `count`, or items
+    before the first heading), since any section could then belong to
+    another photo.
+    """
+    sections: Dict[int, List[str]] = {}
+    current: Optional[int] = None
+    for line in response_text.split("\n"):
+        heading = BATCH_HEADING.match(line)
+        if heading:
+            current = int(heading.group(1))
+            if not 1 <= current <= count or current in sections:
+                return None
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+        elif parse_vision_items(line):
+            return None
+    return {number: "\n".join(lines) for number, lines in sections.items()}
+
+
+async def vision_text(sources: List[Dict[str, str]]) -> str:
+    """One vision call (with retries) for one or several photos; the raw answer."""
+    request = vision_request(sources[0]) if len(sources) == 1 else batch_vision_request(sources)
+    message = await retry_transient(
+        lambda: create_vision_message(VISION_EST_INPUT_TOKENS * len(sources), **request), "Vision call"
+    )
+    return message.content[0].text
+
+
+class VisionBatcher:
+    """
+    Packs photos that reach the vision step together into one multi-image
+    call: a batch goes out once it holds `size` photos or `wait_ms` after
+    its first photo arrived, and each caller gets back its own section of
+    the answer, so caching and aggregation stay per photo. Batches never mix
+    traffic classes. If the provider rejects a batch (400, e.g. one photo
+    URL it can't fetch), skips a photo in its answer or numbers the photos
+    ambiguously, those photos are re-asked on their own. A call whose
+    callers have all left is cancelled. size=1 is a plain call per photo.
+    """
+
+    def __init__(self, size: int, wait_ms: float):
+        self.size = size
+        self.wait_seconds = wait_ms / 1000
+        self._pending: Dict[str, List[tuple[Dict[str, str], asyncio.Future]]] = {}
+        self._running: set = set()
+
+    async def describe(self, source: Dict[str, str]) -> str:
+        """The vision answer for one photo's image source."""
+        if self.size <= 1:
+            return await vision_text([source])
+        cls = traffic_class.get()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(cls, [])
+        batch.append((source, future))
+        if len(batch) >= self.size:
+            self._flush(cls, batch)
+        elif len(batch) == 1:
+            loop.call_later(self.wait_seconds, self._flush, cls, batch)
+        return await future
+
+    def _flush(self, cls: str, batch: List[tuple[Dict[str, str], asyncio.Future]]) -> None:
+        if self._pending.get(cls) is not batch:
+            return  # already sent when it filled up
+        del self._pending[cls]
+        batch = [entry for entry in batch if not entry[1].done()]  # callers that left (e.g. early finish)
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _call(batch: List[tuple[Dict[str, str], asyncio.Future]]) -> str:
+        """vision_text for the batch, cancelled once every caller waiting on it has left."""
+        call = asyncio.ensure_future(vision_text([source for source, _ in batch]))
+
+        def waiter_left(_: asyncio.Future) -> None:
+            if all(future.done() for _, future in batch):
+                call.cancel()  # no-op once the call has answered
+
+        for _, future in batch:
+            future.add_done_callback(waiter_left)
+        return await call
+
+    async def _run(self, batch: List[tuple[Dict[str, str], asyncio.Future]]) -> None:
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return  # every caller left before the call went out
+        retry_alone: List[tuple[Dict[str, str], asyncio.Future]] = []
+        try:
+            if len(batch) == 1:
+                sections = {1: await self._call(batch)}
             else:
-                item_name = line
-                quantity = 1
-            unit_volume = estimate_item_volume(item_name)
-            item_volume = unit_volume * quantity
-            items.append(
-                {
-                    "label": item_name,
-                    "quantity": quantity,
-                    "volume_ft3": round(item_volume, 2),
-                }
-            )
-            total_volume_ft3 += item_volume
+                metrics.incr("vision_batches")
+                metrics.observe("vision_batch_size", len(batch))
+                sections = split_batch_response(await self._call(batch), len(batch))
+            if sections is None:
+                print("[MOVCO] ⚠️  Batched vision answer couldn't be split by photo - asking for each singly")
+                metrics.incr("vision_batch_unsplittable")
+                retry_alone = list(batch)
+            else:
+                for number, (source, future) in enumerate(batch, 1):
+                    if number not in sections:
+                        retry_alone.append((source, future))
+                    elif not future.done():
+                        future.set_result(sections[number])
+            if retry_alone and sections is not None:
+                print(f"[MOVCO] ⚠️  Batched vision answer skipped {len(retry_alone)} photo(s) - asking again singly")
+                metrics.incr("vision_batch_photos_missing", len(retry_alone))
+        except asyncio.CancelledError:
+            if all(future.done() for _, future in batch):
+                metrics.incr("vision_calls_abandoned")
+                return  # _call gave up: nobody is waiting for the answer
+            raise
+        except anthropic.BadRequestError as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            print(f"[MOVCO] ⚠️  Batched vision call rejected ({e.message}) - asking for each photo singly")
+            metrics.incr("vision_batches_split")
+            retry_alone = batch
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if not retry_alone:
+                for _, future in batch:
+                    future.cancel()  # only reached unanswered if this task was cancelled
+        await asyncio.gather(*(self._run([entry]) for entry in retry_alone if not entry[1].done()))
+
+
+vision_batcher = VisionBatcher(VISION_BATCH_SIZE, VISION_BATCH_WAIT_MS)
+
+
+async def analyze_room_by_url(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Vision on a public photo the provider fetches itself. None if it couldn't
+    fetch it (private bucket, missing object, too large), so the caller can
+    fall back to downloading the photo.
+    """
+    cache_key = VisionCache.key_for_url(url)
+    parsed = vision_cache.get(cache_key)
+    timings: Dict[str, float] = {}
+    if parsed is None:
+        print(f"[MOVCO] 🤖 Sending image URL to Claude Vision API...")
+        vision_started = time.perf_counter()
+        try:
+            response_text = await vision_batcher.describe({"type": "url", "url": url})
+        except anthropic.BadRequestError as e:
+            print(f"[MOVCO] ↩️  Vision API couldn't use the photo URL ({e.message}) - downloading it instead")
+            metrics.incr("vision_url_fallbacks")
+            return None
+        timings["vision"] = round((time.perf_counter() - vision_started) * 1000, 1)
+        print(f"[MOVCO] 🤖 Claude response:\n{response_text}\n")
+        parsed = parse_vision_items(response_text)
+        vision_cache.put(cache_key, parsed)
+    metrics.incr("vision_url_sources")
+    items, total_volume_ft3 = size_vision_items(parsed)
+    print(f"[MOVCO] ✓ Detected {len(items)} item types, total: {total_volume_ft3:.2f} ft³ (by URL)")
+    return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2), "timings_ms": timings}
+
+
+async def analyze_room_with_claude(
+    image_url: Optional[str],
+    max_edge: Optional[int] = None,
+    image: Optional[tuple[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    Items and volume in one room photo. The photo is downloaded from
+    `image_url`, unless `image` (base64, media type) is passed in directly,
+    e.g. from an upload. A full-resolution public photo is instead passed to
+    the vision API by URL, falling back to the download if that fails.
+    """
+    if not client:
+        print("[MOVCO] ❌ Anthropic client not initialized")
+        return {"items": [], "total_volume_ft3": 0.0}
+    if vision_breaker.is_open():
+        # Degraded path straight away: don't even download the image
+        print("[MOVCO] 🔌 Anthropic circuit open - skipping vision for this photo")
+        metrics.incr("breaker_anthropic_short_circuited")
+        return failed_photo_result("vision circuit open")
+    stage = "vision_call"
+    try:
+        source_url = direct_image_url(image_url) if image is None and max_edge is None else None
+        if source_url:
+            result = await analyze_room_by_url(source_url)
+            if result is not None:
+                return result
+        stage = "image_download"
+        download_started = time.perf_counter()
+        if image is None:
+            image = await retry_transient(lambda: load_image(image_url), "Image download")
+        base64_image, media_type = image
+        cache_key = VisionCache.key_for(base64_image, max_edge)
+        parsed = vision_cache.get(cache_key)
+        if parsed is not None:
+            items, total_volume_ft3 = size_vision_items(parsed)
+            print(f"[MOVCO] 💾 Vision cache hit: {len(items)} item types, total: {total_volume_ft3:.2f} ft³")
+            return {
+                "items": items,
+                "total_volume_ft3": round(total_volume_ft3, 2),
+                "timings_ms": {"download": round((time.perf_counter() - download_started) * 1000, 1)},
+            }
+        base64_image, media_type, savings = await asyncio.to_thread(
+            preprocess_image, base64_image, media_type, min(max_edge or IMAGE_MAX_EDGE_PX, IMAGE_MAX_EDGE_PX)
+        )
+        if savings:
+            print(f"[MOVCO] 🗜️  Image {savings['bytes_before'] // 1024} KB → {savings['bytes_after'] // 1024} KB, "
+                  f"~{savings['tokens_before']} → ~{savings['tokens_after']} tokens")
+        download_ms = (time.perf_counter() - download_started) * 1000
+        print(f"[MOVCO] 🤖 Sending image to Claude Vision API...")
+        stage = "vision_call"
+        vision_started = time.perf_counter()
+        source = {"type": "base64", "media_type": media_type, "data": base64_image}
+        response_text = await vision_batcher.describe(source)
+        vision_ms = (time.perf_counter() - vision_started) * 1000
+        print(f"[MOVCO] 🤖 Claude response:\n{response_text}\n")
+
+        parsed = parse_vision_items(response_text)
+        vision_cache.put(cache_key, parsed)
+        items, total_volume_ft3 = size_vision_items(parsed)
 
         print(f"[MOVCO] ✓ Detected {len(items)} item types, total: {total_volume_ft3:.2f} ft³")
-        return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2)}
+        return {
+            "items": items,
+            "total_volume_ft3": round(total_volume_ft3, 2),
+            "timings_ms": {"download": round(download_ms, 1), "vision": round(vision_ms, 1)},
+            "preprocess": savings,
+        }
 
+    except asyncio.CancelledError:
+        metrics.incr(f"cancelled_{stage}s")
+        raise
+    except VisionCapacityError:
+        raise
+    except CircuitOpenError:
+        print("[MOVCO] 🔌 Anthropic circuit open - skipping vision for this photo")
+        return failed_photo_result("vision circuit open")
+    except ImageRejected as e:
+        print(f"[MOVCO] 🚫 Photo rejected: {e}")
+        metrics.incr("images_rejected")
+        return dict(failed_photo_result(str(e)), rejected=True)  # retrying won't help
     except Exception as e:
         print(f"[MOVCO] ❌ Error analyzing with Claude: {e}")
         traceback.print_exc()
-        return {"items": [], "total_volume_ft3": 0.0}
+        return failed_photo_result(str(e))
+
+
+async def analyze_photo_cached(url: str, max_edge: Optional[int] = None) -> Dict[str, Any]:
+    """
+    analyze_room_with_claude through single-flight: a photo still being
+    analysed (e.g. pre-analysed at upload) is joined rather than repeated.
+    Finished results are reused through vision_cache, keyed by the image
+    bytes, so a photo re-uploaded under the same URL is analysed afresh.
+    """
+    key = photo_flight_key(url) + (f"@{max_edge}px" if max_edge else "")
+    return await vision_flights.do(key, lambda: analyze_room_with_claude(url, max_edge))
+
+
+async def analyze_photo_safely(
+    index: int,
+    total: int,
+    url: str,
+    limit: asyncio.Semaphore,
+    max_edge: Optional[int] = None,
+) -> Dict[str, Any]:
+    try:
+        await limit.acquire()
+    except asyncio.CancelledError:
+        metrics.incr("cancelled_queued_photos")
+        raise
+    try:
+        print(f"[MOVCO] 📸 Processing photo {index}/{total}")
+        try:
+            return await analyze_photo_cached(url, max_edge)
+        except VisionCapacityError:
+            raise
+        except Exception as e:
+            print(f"[MOVCO] ❌ Error analyzing photo {index}: {e}")
+            traceback.print_exc()
+            return failed_photo_result(str(e))
+    finally:
+        limit.release()
 
 
 def aggregate_items_and_volume(
@@ -751,46 +2206,32 @@ def is_weekend_today() -> bool:
     return datetime.now().weekday() >= 5  # 5=Sat, 6=Sun
 
 
-# ---------- Main endpoint ----------
-
-@app.post("/analyze", response_model=QuoteResponse)
-def analyze_quote(req: QuoteRequest):
-    print(f"\n[MOVCO] ========================================")
-    print(f"[MOVCO] 🚀 Starting analysis of {len(req.photo_urls)} photo(s)")
-    print(f"[MOVCO] 📍 From: {req.starting_address}")
-    print(f"[MOVCO] 📍 To: {req.ending_address}")
-    print(f"[MOVCO] ========================================\n")
+# ---------- Pricing ----------
 
-    # Step 1: Get real distance from Google Maps
-    distance_info = get_google_maps_distance(req.starting_address, req.ending_address)
-    distance_km = distance_info["distance_km"]
+def build_quote_response(
+    photo_count: int,
+    items: List[AiItem],
+    total_volume_ft3: float,
+    distance_info: Dict[str, Any],
+    move_date: Optional[date] = None,
+    stairs_flights: int = 0,
+    movers_override: Optional[int] = None,
+) -> QuoteResponse:
+    """
+    Turn the aggregated inventory + distance into a priced QuoteResponse.
+    Without a move date the weekend premium follows today's date.
+    """
     distance_miles = distance_info["distance_miles"]
     duration_text = distance_info["duration_text"]
 
-    print(f"[MOVCO] 🗺️  Distance: {distance_miles} mi ({distance_km} km), {duration_text}")
-
-    # Step 2: Analyze photos with Claude
-    all_results: List[Dict[str, Any]] = []
-    for i, url in enumerate(req.photo_urls, 1):
-        print(f"[MOVCO] 📸 Processing photo {i}/{len(req.photo_urls)}")
-        try:
-            result = analyze_room_with_claude(url)
-            all_results.append(result)
-        except Exception as e:
-            print(f"[MOVCO] ❌ Error analyzing photo {i}: {e}")
-            traceback.print_exc()
-            all_results.append({"items": [], "total_volume_ft3": 0.0})
-
-    # Step 3: Aggregate items & calculate volume
-    items, total_volume_ft3 = aggregate_items_and_volume(all_results)
     total_volume_m3 = round(total_volume_ft3 * FT3_TO_M3, 2)
     total_area_m2 = round(total_volume_m3 * 1.3, 2)
 
-    # Step 4: Calculate van count & movers (NEW)
+    # Calculate van count & movers
     van_info = calculate_van_count(total_volume_m3)
     van_count = van_info["van_count"]
     van_description = van_info["van_description"]
-    movers = calculate_movers(van_count, total_volume_m3)
+    movers = movers_override or calculate_movers(van_count, total_volume_m3)
 
     print(f"\n[MOVCO] 📊 ANALYSIS RESULTS:")
     print(f"[MOVCO]    Volume: {total_volume_ft3:.1f} ft³ = {total_volume_m3} m³")
@@ -799,42 +2240,42 @@ def analyze_quote(req: QuoteRequest):
     print(f"[MOVCO]    Movers: {movers}")
     print(f"[MOVCO]    Distance: {distance_miles} mi ({duration_text})")
 
-    # Step 5: Weekend check
-    weekend = is_weekend_today()
+    # Weekend check
+    weekend = move_date.weekday() >= 5 if move_date else is_weekend_today()
     if weekend:
         print(f"[MOVCO]    ⚠️  Weekend premium applies (+15%)")
 
-    # Step 6: Rule-based price (NEW — always calculated as sanity check)
+    # Rule-based price (always calculated as sanity check)
     rule_price_info = calculate_rule_based_price(
         total_volume_m3=total_volume_m3,
         distance_miles=distance_miles,
         van_count=van_count,
         movers=movers,
         is_weekend=weekend,
-        stairs_flights=0,
+        stairs_flights=stairs_flights,
     )
     rule_price = rule_price_info["total"]
     print(f"[MOVCO] 💰 Rule-based price: £{rule_price:.2f}")
     print(f"[MOVCO]    Breakdown: {rule_price_info['breakdown']}")
 
-    # Step 7: Use rule-based price directly (simple formula: vans + staff + miles, ×2)
+    # Use rule-based price directly (simple formula: vans + staff + miles, ×2)
     estimate = rule_price
     pricing_method = "calculated"
 
     print(f"[MOVCO] 💰 FINAL PRICE: £{estimate:.2f} (method: {pricing_method})")
 
-    # Step 9: Build rich description (IMPROVED)
+    # Build rich description
     weekend_note = " Weekend rates apply (+15%)." if weekend else ""
+    if stairs_flights:
+        weekend_note = f" Includes {stairs_flights} flight(s) of stairs.{weekend_note}"
     description = (
-        f"Estimate based on AI analysis of {len(req.photo_urls)} room photo(s). "
+        f"Estimate based on AI analysis of {photo_count} room photo(s). "
         f"Detected {len(items)} item type(s) with total volume of {total_volume_m3:.1f} m³. "
         f"You would need {van_description} and {movers} movers for this move. "
         f"Driving distance: {distance_miles} miles ({duration_text}). "
         f"Estimated job time: {rule_price_info['job_hours']} hours.{weekend_note}"
     )
 
-    print(f"[MOVCO] ✅ Analysis complete!\n")
-
     return QuoteResponse(
         estimate=estimate,
         description=description,
@@ -852,6 +2293,1447 @@ def analyze_quote(req: QuoteRequest):
     )
 
 
+# ---------- Quote pipeline ----------
+
+# Optional progress callback: await emit(event_name, payload)
+EventEmitter = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+async def run_quote_pipeline(
+    req: QuoteRequest,
+    emit: Optional[EventEmitter] = None,
+    done_before: Optional[Dict[int, Dict[str, Any]]] = None,
+    job_id: Optional[str] = None,
+    tier: str = "full",
+    analysis_id: Optional[str] = None,
+) -> QuoteResponse:
+    """
+    The pipeline is a small dependency graph:
+
+      distance ─────────────────────────┐
+      photo 1: download → vision ─┐     ├─→ pricing
+      photo N: download → vision ─┴─→ aggregate
+
+    Distance and every photo start together on the event loop; pricing
+    waits for both branches. If `emit` is given it is called as each
+    stage finishes ("distance", then one "photo" per photo in completion
+    order), which is what /analyze/stream forwards to the browser.
+
+    `done_before` maps 1-based photo index -> result for photos that were
+    already analysed (e.g. a resumed job); those skip the vision call.
+
+    With `req.deadline_ms` set, pricing starts at the deadline with whatever
+    has finished. Unfinished photos keep running in the background under a
+    top-up job (see start_topup_job) and their volume is estimated from the
+    photos that did finish.
+
+    Photos that fail even after retries are queued for background
+    re-analysis against a stored quote (`job_id`, or a new record) and the
+    response is flagged provisional.
+
+    `tier` (see choose_quality_tier) trades accuracy for capacity under load:
+    "downscaled" sends smaller images, "sampled" analyses only a subset of
+    photos and extrapolates the rest, "catalogue" skips vision and prices a
+    typical room per photo.
+
+    The inventory is stored under `analysis_id` (a new one if not given)
+    for /quotes/{id}/reprice, together with the provisional/partial state;
+    jobs finishing the quote later overwrite it with the final inventory.
+    """
+    print(f"\n[MOVCO] ========================================")
+    print(f"[MOVCO] 🚀 Starting analysis of {len(req.photo_urls)} photo(s)")
+    print(f"[MOVCO] 📍 From: {req.starting_address}")
+    print(f"[MOVCO] 📍 To: {req.ending_address}")
+    print(f"[MOVCO] ========================================\n")
+
+    started = time.perf_counter()
+    deadline_at = started + req.deadline_ms / 1000 if req.deadline_ms else None
+    total = len(req.photo_urls)
+    limit = asyncio.Semaphore(PHOTO_ANALYSIS_CONCURRENCY)
+    completed: Dict[int, Dict[str, Any]] = dict(done_before or {})
+    max_edge = DEGRADE_DOWNSCALE_EDGE_PX if tier != "full" else None
+    if tier == "catalogue":
+        analysed_indices = []
+    elif tier == "sampled":
+        analysed_indices = sample_photo_indices(total, DEGRADE_SAMPLE_FRACTION)
+    else:
+        analysed_indices = list(range(1, total + 1))
+    skipped = total - len(analysed_indices)
+    if tier != "full":
+        print(f"[MOVCO] 🪫 Under load — quality tier '{tier}' "
+              f"({len(analysed_indices)}/{total} photo(s) through vision)")
+
+    async def distance_stage() -> tuple[Dict[str, Any], float]:
+        info = await distance_flights.do(
+            address_flight_key(req.starting_address, req.ending_address),
+            lambda: get_google_maps_distance(req.starting_address, req.ending_address),
+        )
+        done = time.perf_counter()
+        if emit:
+            await emit("distance", info)
+        return info, done
+
+    async def photo_stage(index: int, url: str) -> tuple[Dict[str, Any], float]:
+        if done_before and index in done_before:
+            return done_before[index], time.perf_counter()
+        result = await analyze_photo_safely(index, total, url, limit, max_edge)
+        done = time.perf_counter()
+        completed[index] = result
+        if emit:
+            running_ft3 = sum(r.get("total_volume_ft3", 0.0) for r in completed.values())
+            running_m3 = round(running_ft3 * FT3_TO_M3, 2)
+            await emit("photo", {
+                "index": index,
+                "photo_url": url,
+                "items": result.get("items", []),
+                "total_volume_ft3": result.get("total_volume_ft3", 0.0),
+                "failed": result.get("failed", False),
+                "photos_completed": len(completed),
+                "photos_total": total,
+                "running_volume_m3": running_m3,
+                "running_van_count": calculate_van_count(running_m3)["van_count"],
+            })
+        return result, done
+
+    distance_task = asyncio.create_task(distance_stage())
+    photo_tasks = {
+        i: asyncio.create_task(photo_stage(i, req.photo_urls[i - 1]))
+        for i in analysed_indices
+    }
+
+    # Steps 1 & 2: photos from Claude + distance from Google Maps (the latter
+    # usually finishes long before the photos), or whatever is done by the deadline
+    try:
+        if deadline_at is None:
+            await asyncio.gather(distance_task, *photo_tasks.values())
+        else:
+            await asyncio.wait(
+                [distance_task, *photo_tasks.values()],
+                timeout=max(deadline_at - time.perf_counter(), 0),
+            )
+    except (asyncio.CancelledError, VisionCapacityError):
+        # Client went away (or the caller was cancelled), or vision is out of
+        # capacity: stop paying for downloads, vision calls and Google Maps
+        # nobody will read.
+        cancel_outstanding_work(distance_task, list(photo_tasks.values()))
+        raise
+    for task in photo_tasks.values():
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            cancel_outstanding_work(distance_task, list(photo_tasks.values()))
+            raise task.exception()
+
+    # Photo results are kept in photo order
+    finished_tasks = [(i, t) for i, t in photo_tasks.items() if t.done()]
+    pending_tasks = {i: t for i, t in photo_tasks.items() if not t.done()}
+    all_results = [t.result()[0] for _, t in finished_tasks]
+    photos_done = max((t.result()[1] for _, t in finished_tasks), default=started)
+    if pending_tasks:
+        photos_done = time.perf_counter()
+
+    if distance_task.done():
+        distance_info, distance_done = distance_task.result()
+    else:
+        print("[MOVCO] ⏰ Deadline reached before Google Maps answered")
+        distance_task.cancel()
+        distance_info, distance_done = fallback_distance(req.starting_address, req.ending_address), time.perf_counter()
+
+    print(f"[MOVCO] 🗺️  Distance: {distance_info['distance_miles']} mi "
+          f"({distance_info['distance_km']} km), {distance_info['duration_text']}")
+
+    # Step 3: Aggregate items & calculate volume
+    aggregate_started = time.perf_counter()
+    estimated_ft3 = 0.0
+    if pending_tasks or skipped:
+        unanalysed = len(pending_tasks) + skipped
+        items, total_volume_ft3, estimated_ft3 = estimate_partial_inventory(
+            all_results, unanalysed,
+            "Estimated items (photos not analysed under load)" if skipped else
+            "Estimated items (photos still processing)",
+        )
+        pending_volume_ft3 = round(estimated_ft3 * len(pending_tasks) / unanalysed, 2)
+    else:
+        items, total_volume_ft3 = aggregate_items_and_volume(all_results)
+
+    # Step 4: Vans, movers & price
+    pricing_started = time.perf_counter()
+    response = build_quote_response(total, items, total_volume_ft3, distance_info)
+    finished = time.perf_counter()
+
+    photo_timings = [r.get("timings_ms", {}) for r in all_results]
+    response.stage_timings_ms = {
+        "distance": round((distance_done - started) * 1000, 1),
+        "photos": round((photos_done - started) * 1000, 1),
+        "image_download_max": max((t.get("download", 0.0) for t in photo_timings), default=0.0),
+        "vision_max": max((t.get("vision", 0.0) for t in photo_timings), default=0.0),
+        "aggregate": round((pricing_started - aggregate_started) * 1000, 1),
+        "pricing": round((finished - pricing_started) * 1000, 1),
+        "total": round((finished - started) * 1000, 1),
+    }
+    response.critical_path = "distance" if distance_done > photos_done else "photos"
+    response.analysis_id = analysis_id or uuid.uuid4().hex
+
+    if tier != "full":
+        apply_tier_note(response, tier, len(analysed_indices), total)
+
+    failed_indices = [i for i, _ in finished_tasks if completed[i].get("failed")]
+    if failed_indices:
+        mark_provisional(response, req, failed_indices)
+        if not pending_tasks:  # otherwise the top-up job retries them below
+            response.quote_id = defer_failed_photos(
+                req, completed, failed_indices, job_id, response, tier, estimated_ft3
+            )
+
+    if pending_tasks:
+        response.is_partial = True
+        response.critical_path = "deadline"
+        response.included_photo_urls = [req.photo_urls[i - 1] for i, _ in finished_tasks]
+        response.pending_photo_urls = [req.photo_urls[i - 1] for i in pending_tasks]
+        response.estimated_pending_volume_ft3 = pending_volume_ft3
+        response.topup_job_id = start_topup_job(req, completed, pending_tasks, response.analysis_id)
+        if failed_indices:
+            response.quote_id = response.topup_job_id
+        response.description += (
+            f" Provisional: {len(finished_tasks)} of {total} photo(s) analysed within the time limit; "
+            f"the rest are estimated and still being analysed."
+        )
+        print(f"[MOVCO] ⏰ Deadline reached: {len(pending_tasks)} photo(s) pending, "
+              f"top-up job {response.topup_job_id}")
+
+    analysis_store.save(
+        req, items, total_volume_ft3, distance_info, tier, len(analysed_indices),
+        analysis_state(response), response.analysis_id,
+    )
+
+    print(f"[MOVCO] ⏱️  Stage timings (ms): {response.stage_timings_ms} "
+          f"— critical path: {response.critical_path}")
+    print(f"[MOVCO] ✅ Analysis complete!\n")
+
+    return response
+
+
+def apply_tier_note(response: QuoteResponse, tier: str, analysed: int, total: int) -> None:
+    """Record a degraded quality tier in pricing_method and the description."""
+    response.pricing_method = f"{response.pricing_method}_{tier}"
+    response.description += {
+        "downscaled": " Busy period: photos were analysed at reduced resolution.",
+        "sampled": f" Busy period: {analysed} of {total} photo(s) were analysed "
+                   f"and the rest estimated from them.",
+        "catalogue": f" Busy period: volume estimated from {total} room(s) at a typical "
+                     f"room size rather than from the photos.",
+    }[tier]
+
+
+def cancel_outstanding_work(distance_task: asyncio.Task, photo_tasks: List[asyncio.Task]) -> None:
+    """Cancel the still-running branches of a pipeline and count what was reclaimed."""
+    metrics.incr("cancelled_pipelines")
+    if not distance_task.done():
+        distance_task.cancel()
+        metrics.incr("cancelled_distance_lookups")
+    for task in photo_tasks:
+        if not task.done():
+            task.cancel()
+    # Per-stage counts (queued / downloading / in a vision call) are recorded
+    # by the photo tasks themselves as the cancellation lands.
+
+
+def estimate_partial_inventory(
+    finished_results: List[Dict[str, Any]],
+    pending_count: int,
+    placeholder_name: str = "Estimated items (photos still processing)",
+) -> tuple[List[AiItem], float, float]:
+    """
+    Aggregate the photos that finished and add a placeholder line for the
+    ones still pending (or skipped), sized at the average volume of the
+    finished photos. Returns (items, total_volume_ft3, pending_volume_ft3).
+    """
+    detected = [r for r in finished_results if r.get("items")]
+    if detected:
+        items, total_volume_ft3 = aggregate_items_and_volume(detected)
+        per_photo = total_volume_ft3 / len(finished_results)
+    else:
+        items, total_volume_ft3 = [], 0.0
+        per_photo = AVERAGE_PHOTO_VOLUME_FT3
+    pending_volume_ft3 = round(per_photo * pending_count, 2)
+    items.append(
+        AiItem(
+            name=placeholder_name,
+            quantity=pending_count,
+            note=f"Estimated from the average of {len(finished_results)} analysed photo(s)"
+            if finished_results else "Estimated from a typical room volume",
+            estimated_volume_ft3=pending_volume_ft3,
+        )
+    )
+    return items, total_volume_ft3 + pending_volume_ft3, pending_volume_ft3
+
+
+def analysis_state(response: QuoteResponse) -> Dict[str, Any]:
+    """The provisional/partial fields of a quote, stored with its analysis for re-pricing."""
+    return response.model_dump(include={
+        "is_provisional", "failed_photo_urls", "quote_id",
+        "is_partial", "included_photo_urls", "pending_photo_urls",
+        "estimated_pending_volume_ft3", "topup_job_id",
+    })
+
+
+def mark_provisional(response: QuoteResponse, req: QuoteRequest, failed_indices: List[int]) -> None:
+    response.is_provisional = True
+    response.failed_photo_urls = [req.photo_urls[i - 1] for i in failed_indices]
+    response.description += (
+        f" Provisional: {len(failed_indices)} photo(s) could not be analysed yet and are "
+        f"being retried; the quote will be updated."
+    )
+
+
+def defer_failed_photos(
+    req: QuoteRequest,
+    completed: Dict[int, Dict[str, Any]],
+    failed_indices: List[int],
+    job_id: Optional[str],
+    response: QuoteResponse,
+    tier: str = "full",
+    unanalysed_estimate_ft3: float = 0.0,
+) -> str:
+    """
+    Queue failed photos for background re-analysis. Quotes that aren't
+    already a job get a stored record so there is something to update,
+    including the quality tier and the volume estimated for photos that
+    tier skipped, so a re-price applies them again.
+    Returns the stored quote's ID.
+    """
+    if job_id is None:
+        job_id = job_store.create(req, tier, unanalysed_estimate_ft3, response.analysis_id)
+        for index, result in completed.items():
+            job_store.record_photo(job_id, index, result)
+        response.quote_id = job_id
+        job_store.complete(job_id, response, status="provisional")
+    for index in failed_indices:
+        job_store.enqueue_reanalysis(job_id, index, req.photo_urls[index - 1])
+    metrics.incr("reanalysis_enqueued", len(failed_indices))
+    print(f"[MOVCO] 📮 {len(failed_indices)} failed photo(s) queued for re-analysis (quote {job_id})")
+    return job_id
+
+
+# ---------- Background quote jobs ----------
+
+class QuoteJobStore:
+    """
+    SQLite-backed record of every background quote job. Each photo's
+    result is written as soon as it finishes, so a restarted worker picks
+    up where the last one stopped instead of re-running vision calls.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS quote_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request_json TEXT NOT NULL,
+                    photo_results_json TEXT NOT NULL,
+                    result_json TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    tier TEXT NOT NULL DEFAULT 'full',
+                    unanalysed_estimate_ft3 REAL NOT NULL DEFAULT 0,
+                    analysis_id TEXT
+                )
+                """
+            )
+            # Job files written before these columns existed
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(quote_jobs)")}
+            for column, definition in (
+                ("tier", "TEXT NOT NULL DEFAULT 'full'"),
+                ("unanalysed_estimate_ft3", "REAL NOT NULL DEFAULT 0"),
+                ("analysis_id", "TEXT"),
+            ):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE quote_jobs ADD COLUMN {column} {definition}")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reanalysis_queue (
+                    job_id TEXT NOT NULL,
+                    photo_index INTEGER NOT NULL,
+                    photo_url TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    PRIMARY KEY (job_id, photo_index)
+                )
+                """
+            )
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def create(
+        self,
+        req: QuoteRequest,
+        tier: str = "full",
+        unanalysed_estimate_ft3: float = 0.0,
+        analysis_id: Optional[str] = None,
+    ) -> str:
+        """
+        A new job with no photo results yet. Under the "sampled" tier the
+        photos it skips stay None for good; `unanalysed_estimate_ft3` is the
+        volume they were priced at. `analysis_id` is the stored analysis the
+        job brings up to date when it finishes the quote.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO quote_jobs (id, status, request_json, photo_results_json, created_at, "
+            "updated_at, tier, unanalysed_estimate_ft3, analysis_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, "queued", req.model_dump_json(), json.dumps([None] * len(req.photo_urls)),
+             now, now, tier, unanalysed_estimate_ft3, analysis_id),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM quote_jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "request": QuoteRequest.model_validate_json(row["request_json"]),
+            "photo_results": json.loads(row["photo_results_json"]),
+            "result": json.loads(row["result_json"]) if row["result_json"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "tier": row["tier"],
+            "unanalysed_estimate_ft3": row["unanalysed_estimate_ft3"],
+            "analysis_id": row["analysis_id"],
+        }
+
+    def assign_analysis_id(self, job_id: str) -> str:
+        analysis_id = uuid.uuid4().hex
+        self._execute("UPDATE quote_jobs SET analysis_id = ? WHERE id = ?", (analysis_id, job_id))
+        return analysis_id
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        self._execute(
+            "UPDATE quote_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+    def record_photo(self, job_id: str, index: int, result: Dict[str, Any]) -> None:
+        """Store one photo's result (1-based index, as in the pipeline)."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT photo_results_json FROM quote_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return
+            photo_results = json.loads(row["photo_results_json"])
+            photo_results[index - 1] = result
+            self._conn.execute(
+                "UPDATE quote_jobs SET photo_results_json = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(photo_results), time.time(), job_id),
+            )
+
+    def complete(
+        self,
+        job_id: str,
+        response: QuoteResponse,
+        status: str = "completed",
+        unanalysed_estimate_ft3: Optional[float] = None,
+    ) -> None:
+        self._execute(
+            "UPDATE quote_jobs SET status = ?, result_json = ?, error = NULL, updated_at = ?, "
+            "unanalysed_estimate_ft3 = COALESCE(?, unanalysed_estimate_ft3) WHERE id = ?",
+            (status, response.model_dump_json(), time.time(), unanalysed_estimate_ft3, job_id),
+        )
+
+    # -- durable re-analysis queue for photos that failed --
+
+    def enqueue_reanalysis(self, job_id: str, index: int, url: str) -> None:
+        self._execute(
+            "INSERT OR IGNORE INTO reanalysis_queue (job_id, photo_index, photo_url, next_attempt_at) "
+            "VALUES (?, ?, ?, ?)",
+            (job_id, index, url, time.time() + REANALYSIS_BASE_DELAY_SECONDS),
+        )
+
+    def due_reanalysis(self, limit: int = 20) -> List[sqlite3.Row]:
+        return self._execute(
+            "SELECT * FROM reanalysis_queue WHERE next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?",
+            (time.time(), limit),
+        )
+
+    def reschedule_reanalysis(self, job_id: str, index: int, delay: float, error: str) -> int:
+        """Push an entry back by `delay` seconds; returns its attempt count so far."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE reanalysis_queue SET attempts = attempts + 1, next_attempt_at = ?, "
+                "last_error = ? WHERE job_id = ? AND photo_index = ?",
+                (time.time() + delay, error, job_id, index),
+            )
+            row = self._conn.execute(
+                "SELECT attempts FROM reanalysis_queue WHERE job_id = ? AND photo_index = ?",
+                (job_id, index),
+            ).fetchone()
+            return row["attempts"] if row else 0
+
+    def remove_reanalysis(self, job_id: str, index: int) -> None:
+        self._execute(
+            "DELETE FROM reanalysis_queue WHERE job_id = ? AND photo_index = ?", (job_id, index)
+        )
+
+    def unfinished_ids(self) -> List[str]:
+        rows = self._execute(
+            "SELECT id FROM quote_jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        )
+        return [row["id"] for row in rows]
+
+    def purge_older_than(self, seconds: float) -> int:
+        cutoff = time.time() - seconds
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM quote_jobs WHERE status IN ('completed', 'provisional', 'failed') "
+                "AND updated_at < ?",
+                (cutoff,),
+            )
+            self._conn.execute(
+                "DELETE FROM reanalysis_queue WHERE job_id NOT IN (SELECT id FROM quote_jobs)"
+            )
+            return cur.rowcount
+
+
+class QuoteJobStatus(BaseModel):
+    job_id: str
+    status: str  # "queued", "running", "completed", "provisional" or "failed"
+    photos_total: int
+    photos_completed: int
+    items: List[AiItem] = []  # aggregated from the photos finished so far
+    result: Optional[QuoteResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
+job_store = QuoteJobStore(QUOTE_JOBS_DB_PATH)
+job_queue: asyncio.Queue = asyncio.Queue()
+job_workers: List[asyncio.Task] = []
+topup_tasks: set = set()  # strong refs so pending top-ups aren't garbage-collected
+
+
+def build_job_status(job: Dict[str, Any]) -> QuoteJobStatus:
+    finished = [r for r in job["photo_results"] if r is not None]
+    # Don't let the "Miscellaneous items" fallback leak into partial results
+    items = aggregate_items_and_volume(finished)[0] if any(r.get("items") for r in finished) else []
+    return QuoteJobStatus(
+        job_id=job["id"],
+        status=job["status"],
+        photos_total=len(job["photo_results"]),
+        photos_completed=len(finished),
+        items=items,
+        result=job["result"],
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
+
+
+async def run_quote_job(job_id: str) -> None:
+    job = job_store.get(job_id)
+    if job is None or job["status"] not in ("queued", "running"):
+        return
+    job_store.set_status(job_id, "running")
+    # Background jobs have no client waiting, so they always run to completion
+    req = job["request"].model_copy(update={"deadline_ms": None})
+
+    # Photos already recorded by a previous (crashed) run are reused as-is;
+    # failed ones get another go
+    done_before = {
+        i: result for i, result in enumerate(job["photo_results"], 1)
+        if result is not None and not result.get("failed")
+    }
+
+    async def record_progress(event: str, data: Dict[str, Any]) -> None:
+        if event == "photo":
+            result = {"items": data["items"], "total_volume_ft3": data["total_volume_ft3"]}
+            if data["failed"]:
+                result["failed"] = True
+            job_store.record_photo(job_id, data["index"], result)
+
+    # The job's quote (and any later re-analysis) keeps one stored analysis up to date
+    analysis_id = job["analysis_id"] or job_store.assign_analysis_id(job_id)
+    try:
+        response = await run_quote_pipeline(
+            req, record_progress, done_before, job_id, analysis_id=analysis_id
+        )
+        response.quote_id = job_id
+        job_store.complete(job_id, response, "provisional" if response.is_provisional else "completed")
+        print(f"[MOVCO] ✅ Job {job_id} completed")
+    except VisionCapacityError as e:
+        # Not a failure: put the job back and try again once capacity frees up
+        print(f"[MOVCO] ⏳ Job {job_id} deferred {e.retry_after:.0f}s (vision at capacity)")
+        job_store.set_status(job_id, "queued")
+        asyncio.get_running_loop().call_later(e.retry_after, job_queue.put_nowait, job_id)
+    except Exception as e:
+        print(f"[MOVCO] ❌ Job {job_id} failed: {e}")
+        traceback.print_exc()
+        job_store.set_status(job_id, "failed", error=str(e))
+
+
+def start_topup_job(
+    req: QuoteRequest,
+    completed: Dict[int, Dict[str, Any]],
+    pending_tasks: Dict[int, asyncio.Task],
+    analysis_id: Optional[str] = None,
+) -> str:
+    """
+    Hand photos still in flight at the deadline over to a job. The job
+    starts with the finished photos recorded; each pending photo is recorded
+    as it lands and the job then goes on job_queue, where a worker prices the
+    full quote and replaces the partial stored analysis `analysis_id`.
+    Poll it with GET /analyze/jobs/{id}.
+    """
+    job_id = job_store.create(req, analysis_id=analysis_id)
+    job_store.set_status(job_id, "running")
+    for index, result in completed.items():
+        if index not in pending_tasks:
+            job_store.record_photo(job_id, index, result)
+
+    async def finish() -> None:
+        # No client waits on this any more: anything it starts (a re-run of a
+        # cancelled photo) must not compete with interactive quotes
+        traffic_class.set("background")
+        for index, task in pending_tasks.items():
+            await asyncio.wait({task})
+            if not task.cancelled():  # a cancelled photo is re-run by the job
+                job_store.record_photo(job_id, index, task.result()[0])
+        job_store.set_status(job_id, "queued")
+        await job_queue.put(job_id)
+
+    finisher = asyncio.create_task(finish())
+    topup_tasks.add(finisher)
+    finisher.add_done_callback(topup_tasks.discard)
+    return job_id
+
+
+async def quote_job_worker(worker_id: int) -> None:
+    traffic_class.set("background")
+    while True:
+        job_id = await job_queue.get()
+        try:
+            await run_quote_job(job_id)
+        except Exception as e:
+            print(f"[MOVCO] ❌ Job worker {worker_id} crashed on {job_id}: {e}")
+            traceback.print_exc()
+        finally:
+            job_queue.task_done()
+
+
+async def start_job_workers() -> None:
+    purged = job_store.purge_older_than(QUOTE_JOB_RETENTION_SECONDS)
+    purged += analysis_store.purge_older_than(ANALYSIS_RETENTION_SECONDS)
+    resumed = job_store.unfinished_ids()
+    for job_id in resumed:
+        job_queue.put_nowait(job_id)
+    for worker_id in range(QUOTE_JOB_WORKERS):
+        job_workers.append(asyncio.create_task(quote_job_worker(worker_id)))
+    print(f"[MOVCO] 🧵 {QUOTE_JOB_WORKERS} quote job worker(s) started "
+          f"({len(resumed)} resumed, {purged} old job(s)/analyses purged)")
+
+
+async def stop_job_workers() -> None:
+    for task in job_workers:
+        task.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    job_workers.clear()
+
+
+async def reprice_stored_quote(job_id: str) -> None:
+    """Re-price a provisional quote after one of its photos was re-analysed."""
+    job = job_store.get(job_id)
+    if job is None or job["status"] != "provisional":
+        return  # a running job prices itself when it finishes
+    req = job["request"]
+    results = job["photo_results"]
+    # Photos the quality tier never analysed (None) are estimated from the
+    # analysed ones again, exactly as when the quote was first priced
+    analysed = [r for r in results if r is not None]
+    unanalysed = len(results) - len(analysed)
+    estimated_ft3 = 0.0
+    if unanalysed:
+        items, total_volume_ft3, estimated_ft3 = estimate_partial_inventory(
+            analysed, unanalysed, "Estimated items (photos not analysed under load)"
+        )
+    else:
+        items, total_volume_ft3 = aggregate_items_and_volume(analysed)
+    distance_info = await distance_flights.do(
+        address_flight_key(req.starting_address, req.ending_address),
+        lambda: get_google_maps_distance(req.starting_address, req.ending_address),
+    )
+    response = build_quote_response(len(results), items, total_volume_ft3, distance_info)
+    response.quote_id = job_id
+    if job["tier"] != "full":
+        apply_tier_note(response, job["tier"], len(analysed), len(results))
+    failed_indices = [i for i, r in enumerate(results, 1) if r is not None and r.get("failed")]
+    if failed_indices:
+        mark_provisional(response, req, failed_indices)
+    if job["analysis_id"]:
+        response.analysis_id = job["analysis_id"]
+        analysis_store.save(
+            req, items, total_volume_ft3, distance_info, job["tier"], len(analysed),
+            analysis_state(response), job["analysis_id"],
+        )
+    job_store.complete(
+        job_id, response, "provisional" if failed_indices else "completed", estimated_ft3
+    )
+    print(f"[MOVCO] 💷 Quote {job_id} re-priced: £{response.estimate:.2f}"
+          f"{' (still provisional)' if failed_indices else ''}")
+
+
+async def reanalyze_photo(entry: sqlite3.Row) -> None:
+    job_id, index, url = entry["job_id"], entry["photo_index"], entry["photo_url"]
+    print(f"[MOVCO] 🔁 Re-analysing photo {index} of quote {job_id}")
+    try:
+        result = await analyze_photo_cached(url)
+    except VisionCapacityError as e:
+        job_store.reschedule_reanalysis(job_id, index, e.retry_after, str(e))
+        return
+    if result.get("failed"):
+        attempts = job_store.reschedule_reanalysis(
+            job_id, index,
+            backoff_delay(entry["attempts"] + 2, REANALYSIS_BASE_DELAY_SECONDS, 3600),
+            result.get("error", ""),
+        )
+        if attempts >= REANALYSIS_MAX_ATTEMPTS or result.get("rejected"):
+            print(f"[MOVCO] ❌ Giving up on photo {index} of quote {job_id} after {attempts} attempts")
+            metrics.incr("reanalysis_abandoned")
+            job_store.remove_reanalysis(job_id, index)
+        return
+    metrics.incr("reanalysis_succeeded")
+    job_store.record_photo(job_id, index, result)
+    try:
+        await reprice_stored_quote(job_id)
+    except Exception as e:
+        # Keep the entry so the re-price is tried again (the photo itself comes from cache)
+        job_store.reschedule_reanalysis(
+            job_id, index,
+            backoff_delay(entry["attempts"] + 2, REANALYSIS_BASE_DELAY_SECONDS, 3600),
+            f"re-price failed: {e}",
+        )
+        raise
+    job_store.remove_reanalysis(job_id, index)
+
+
+async def reanalysis_worker() -> None:
+    """Drain the durable re-analysis queue, one due photo at a time."""
+    traffic_class.set("background")
+    while True:
+        await asyncio.sleep(REANALYSIS_POLL_SECONDS)
+        try:
+            for entry in job_store.due_reanalysis():
+                await reanalyze_photo(entry)
+        except Exception as e:
+            print(f"[MOVCO] ❌ Re-analysis worker error: {e}")
+            traceback.print_exc()
+
+
+# ---------- Stored analyses (re-pricing) ----------
+
+class AnalysisStore:
+    """
+    The aggregated inventory and distance behind every priced quote, by
+    analysis ID, so a re-quote with a different date, stairs, movers or
+    address only re-runs pricing (plus Google Maps if an address changed).
+    Lives in the job store's SQLite file.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS analyses (
+                    id TEXT PRIMARY KEY,
+                    request_json TEXT NOT NULL,
+                    items_json TEXT NOT NULL,
+                    total_volume_ft3 REAL NOT NULL,
+                    distance_json TEXT NOT NULL,
+                    tier TEXT NOT NULL,
+                    photos_analysed INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    state_json TEXT NOT NULL DEFAULT '{}'
+                )
+                """
+            )
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(analyses)")}
+            if "state_json" not in columns:
+                self._conn.execute("ALTER TABLE analyses ADD COLUMN state_json TEXT NOT NULL DEFAULT '{}'")
+
+    def save(
+        self,
+        req: QuoteRequest,
+        items: List[AiItem],
+        total_volume_ft3: float,
+        distance_info: Dict[str, Any],
+        tier: str,
+        photos_analysed: int,
+        state: Optional[Dict[str, Any]] = None,
+        analysis_id: Optional[str] = None,
+    ) -> str:
+        """
+        Store an analysis, or replace `analysis_id` once re-analysis or a
+        top-up job has finished it. `state` is the quote's provisional/partial
+        fields (see analysis_state).
+        """
+        analysis_id = analysis_id or uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (id, request_json, items_json, total_volume_ft3, "
+                "distance_json, tier, photos_analysed, created_at, state_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (analysis_id, req.model_dump_json(),
+                 json.dumps([item.model_dump() for item in items]), total_volume_ft3,
+                 json.dumps(distance_info), tier, photos_analysed, time.time(),
+                 json.dumps(state or {})),
+            )
+        return analysis_id
+
+    def get(self, analysis_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM analyses WHERE id = ?", (analysis_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "request": QuoteRequest.model_validate_json(row["request_json"]),
+            "items": [AiItem(**item) for item in json.loads(row["items_json"])],
+            "total_volume_ft3": row["total_volume_ft3"],
+            "distance": json.loads(row["distance_json"]),
+            "tier": row["tier"],
+            "photos_analysed": row["photos_analysed"],
+            "state": json.loads(row["state_json"]),
+        }
+
+    def purge_older_than(self, seconds: float) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM analyses WHERE created_at < ?", (time.time() - seconds,)
+            )
+            return cur.rowcount
+
+
+analysis_store = AnalysisStore(QUOTE_JOBS_DB_PATH)
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+# ---------- Per-client rate limiting ----------
+
+class ClientRateLimited(Exception):
+    """A client (IP or API key) is over its photo allowance."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory; least recently used keys are dropped first."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        """Take `cost` tokens; returns 0 on success, else seconds until they'd be available."""
+        now = time.time()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+        if not wait:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path: str, idle_seconds: float = 3600):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._takes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE: take the write lock up front so two workers can't both
+            # read the same balance and spend it twice
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (key, tokens, now)
+                )
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    self._conn.execute(
+                        "DELETE FROM rate_buckets WHERE updated_at < ?", (now - self.idle_seconds,)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+class ClientRateLimiter:
+    """
+    Per-client photo allowance, checked before any image is downloaded.
+    Requests with a configured X-API-Key draw from that key's bucket, split
+    per end user when the keyed client names one in X-Movco-Client-Id;
+    everything else draws from the caller's IP bucket.
+    """
+
+    def __init__(self, store, ip_per_minute: float, ip_burst: float, key_limits: Dict[str, float]):
+        self.store = store
+        self.ip_per_minute = ip_per_minute
+        self.ip_burst = ip_burst
+        self.key_limits = key_limits
+
+    @staticmethod
+    def client_ip(request: Request) -> str:
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded and TRUSTED_PROXY_HOPS > 0:
+            # Only the hops our own proxies appended can be trusted
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+        return request.client.host if request.client else "unknown"
+
+    def check(self, request: Request, photo_count: int) -> None:
+        api_key = request.headers.get("x-api-key")
+        if api_key and api_key in self.key_limits:
+            kind = "key"
+            bucket = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+            client_id = request.headers.get("x-movco-client-id", "").strip()
+            if client_id:
+                bucket += ":" + client_id[:64]
+            per_minute = burst = self.key_limits[api_key]
+        else:
+            kind = "ip"
+            bucket = "ip:" + self.client_ip(request)
+            per_minute, burst = self.ip_per_minute, self.ip_burst
+        if per_minute <= 0:
+            return
+        # A request bigger than the whole bucket can still get in once it is full
+        cost = min(max(1, photo_count), burst)
+        wait = self.store.take(bucket, cost, burst, per_minute / 60)
+        if wait:
+            metrics.incr("rate_limit_rejections")
+            metrics.incr(f"rate_limit_rejections_{kind}")
+            print(f"[MOVCO] 🚦 Rate limited {bucket} ({photo_count} photo(s)), retry in {wait:.0f}s")
+            raise ClientRateLimited(wait)
+
+
+client_rate_limiter = ClientRateLimiter(
+    SQLiteBucketStore(RATE_LIMIT_DB_PATH) if RATE_LIMIT_DB_PATH else MemoryBucketStore(),
+    RATE_LIMIT_IP_PER_MINUTE,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_API_KEYS,
+)
+
+
+# ---------- Speculative pre-analysis ----------
+
+prewarm_limit = asyncio.Semaphore(PREWARM_CONCURRENCY)
+prewarm_tasks: set = set()  # strong refs so running pre-analyses aren't garbage-collected
+
+
+def ingest_photo_urls(payload: Dict[str, Any]) -> List[str]:
+    """
+    Photo URLs from an ingest call: {"photo_url": ...}, {"photo_urls": [...]},
+    or a Supabase database webhook on storage.objects ({"type": "INSERT" or
+    "UPDATE", "record": {"bucket_id": ..., "name": ...}}), which needs
+    SUPABASE_URL. An UPDATE is an upload replacing the object at that path.
+    """
+    urls = list(payload.get("photo_urls") or [])
+    if payload.get("photo_url"):
+        urls.append(payload["photo_url"])
+    record = payload.get("record")
+    if isinstance(record, dict) and payload.get("type", "INSERT") in ("INSERT", "UPDATE"):
+        if not SUPABASE_URL:
+            raise HTTPException(status_code=422, detail="SUPABASE_URL is not configured")
+        urls.append(f"{SUPABASE_URL}/storage/v1/object/public/{record['bucket_id']}/{record['name']}")
+    return [url for url in urls if isinstance(url, str) and url.strip()]
+
+
+async def prewarm_photo(url: str) -> None:
+    """
+    Analyse an uploaded photo ahead of /analyze. Runs as background traffic;
+    if vision is busy it only fetches the image, so the real request skips
+    the download at least.
+    """
+    traffic_class.set("background")
+    async with prewarm_limit:
+        try:
+            try:
+                vision_limiter.check_admission()
+            except VisionCapacityError:
+                metrics.incr("prewarm_image_only")
+                await retry_transient(lambda: load_image(url), "Image pre-fetch")
+                return
+            result = await analyze_photo_cached(url)
+            metrics.incr("prewarm_failed" if result.get("failed") else "prewarm_completed")
+        except Exception as e:
+            print(f"[MOVCO] ❌ Pre-analysis of {url[:80]} failed: {e}")
+            metrics.incr("prewarm_failed")
+
+
+def start_prewarm(url: str) -> None:
+    # The object may have been replaced under the same path: forget what the
+    # URL pointed at before, so the new bytes are fetched and analysed
+    image_cache.discard(photo_flight_key(url))
+    vision_cache.discard(VisionCache.key_for_url(url))
+    task = asyncio.create_task(prewarm_photo(url))
+    prewarm_tasks.add(task)
+    task.add_done_callback(prewarm_tasks.discard)
+
+
+# ---------- Idempotency keys ----------
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyStore:
+    """
+    Remembers /analyze executions by Idempotency-Key. A retry that arrives
+    while the first execution is still running attaches to it; a retry after
+    it finished gets the stored QuoteResponse back. Completed entries expire
+    after IDEMPOTENCY_TTL_SECONDS and the oldest are evicted beyond
+    IDEMPOTENCY_MAX_ENTRIES.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._completed: "OrderedDict[str, tuple[float, str, QuoteResponse]]" = OrderedDict()
+        self._in_flight: Dict[str, tuple[str, asyncio.Task]] = {}
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        while self._completed:
+            key, (stored_at, _, _) = next(iter(self._completed.items()))
+            if stored_at >= cutoff and len(self._completed) <= self.max_entries:
+                break
+            del self._completed[key]
+
+    def get_or_start(
+        self,
+        key: str,
+        fingerprint: str,
+        start: Callable[[], Awaitable[QuoteResponse]],
+    ) -> tuple[Optional[QuoteResponse], Optional[asyncio.Task]]:
+        """
+        Returns (stored_response, None) for a replay, otherwise (None, task)
+        where task is the in-flight execution (existing or newly started).
+        Raises IdempotencyConflict if the key was used for a different body.
+        `start` is only called for a new execution; anything it raises
+        (rate limiting, admission) propagates and nothing is recorded.
+        """
+        self._evict()
+        if key in self._completed:
+            _, stored_fingerprint, response = self._completed[key]
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            metrics.incr("idempotency_replays")
+            return response, None
+        if key in self._in_flight:
+            running_fingerprint, task = self._in_flight[key]
+            if running_fingerprint != fingerprint:
+                raise IdempotencyConflict(key)
+            metrics.incr("idempotency_attached")
+            return None, task
+
+        metrics.incr("idempotency_executions")
+        task = asyncio.create_task(start())
+        self._in_flight[key] = (fingerprint, task)
+        task.add_done_callback(lambda t: self._finish(key, fingerprint, t))
+        return None, task
+
+    def _finish(self, key: str, fingerprint: str, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._completed[key] = (time.time(), fingerprint, task.result())
+            self._evict()
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL_SECONDS)
+
+
+def request_fingerprint(req: QuoteRequest) -> str:
+    return hashlib.sha256(req.model_dump_json().encode("utf-8")).hexdigest()
+
+
+# ---------- Main endpoints ----------
+
+@app.exception_handler(ClientRateLimited)
+async def client_rate_limited_handler(request: Request, exc: ClientRateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many photos analysed from this client, please retry later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.exception_handler(VisionCapacityError)
+async def vision_capacity_handler(request: Request, exc: VisionCapacityError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Quote service is at capacity, please retry shortly"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+async def run_until_disconnect(request: Request, work: Awaitable[Any]) -> Optional[Any]:
+    """
+    Await `work`, polling the connection meanwhile. If the client goes away
+    (tab closed, frontend timeout) the work is cancelled and None returned.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("[MOVCO] 🔌 Client disconnected — cancelling analysis")
+                metrics.incr("client_disconnects")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def admit_quote() -> str:
+    """Pick the quality tier for a new quote; vision tiers must pass admission control."""
+    tier = choose_quality_tier()
+    if tier != "catalogue":
+        vision_limiter.check_admission()
+    return tier
+
+
+@app.post("/analyze", response_model=QuoteResponse)
+async def analyze_quote(
+    req: QuoteRequest,
+    request: Request,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    traffic_class_header: Optional[str] = Header(None, alias="X-Movco-Traffic-Class"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+):
+    traffic_class.set(resolve_traffic_class(traffic_class_header, api_key))
+    if not idempotency_key:
+        client_rate_limiter.check(request, len(req.photo_urls))
+        tier = admit_quote()
+        quote = await run_until_disconnect(request, run_quote_pipeline(req, tier=tier))
+    else:
+        def start() -> Awaitable[QuoteResponse]:
+            # Only a new execution is charged: a retry that replays or attaches
+            # to this key must not be turned away by the photos it already paid for.
+            client_rate_limiter.check(request, len(req.photo_urls))
+            return run_quote_pipeline(req, tier=admit_quote())
+
+        try:
+            stored, task = idempotency_store.get_or_start(
+                idempotency_key, request_fingerprint(req), start
+            )
+        except IdempotencyConflict:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request body",
+            )
+        if stored is not None:
+            print(f"[MOVCO] ♻️  Replaying stored quote for Idempotency-Key {idempotency_key}")
+            response.headers["Idempotent-Replayed"] = "true"
+            return stored
+        # Shielded: if this client disconnects the execution keeps running,
+        # so the retry that usually follows can attach to it or replay it.
+        quote = await run_until_disconnect(request, asyncio.shield(task))
+    if quote is None:
+        return Response(status_code=499)  # client closed request; nobody is listening
+    return quote
+
+
+@app.post("/analyze/stream")
+async def analyze_quote_stream(
+    req: QuoteRequest,
+    request: Request,
+    traffic_class_header: Optional[str] = Header(None, alias="X-Movco-Traffic-Class"),
+    api_key: Optional[str] = Header(None, alias="X-API-Key"),
+):
+    """
+    Same pipeline as /analyze, streamed as Server-Sent Events:
+
+      event: distance  — distance/duration once Google Maps answers
+      event: photo     — one per photo as its vision call returns, with
+                         that photo's items plus running volume & van count
+      event: quote     — the full QuoteResponse (last event)
+      event: error     — pipeline failed; stream ends
+
+    A comment line is sent every SSE_KEEPALIVE_SECONDS while waiting so
+    proxies don't close an idle connection on long multi-room jobs.
+    """
+    client_rate_limiter.check(request, len(req.photo_urls))
+    cls = resolve_traffic_class(traffic_class_header, api_key)
+    traffic_class.set(cls)
+    tier = admit_quote()
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def emit(event: str, data: Dict[str, Any]) -> None:
+        await events.put((event, data))
+
+    async def run() -> None:
+        traffic_class.set(cls)  # the response body streams outside this handler's context
+        try:
+            quote = await run_quote_pipeline(req, emit, tier=tier)
+            await events.put(("quote", quote))
+        except Exception as e:
+            print(f"[MOVCO] ❌ Streaming analysis failed: {e}")
+            traceback.print_exc()
+            await events.put(("error", {"detail": str(e)}))
+        finally:
+            await events.put(None)
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                event, data = message
+                yield format_sse(event, data)
+        finally:
+            if not task.done():
+                print("[MOVCO] 🔌 Stream client disconnected — cancelling analysis")
+                metrics.incr("client_disconnects")
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/analyze/jobs", response_model=QuoteJobStatus, status_code=202)
+async def create_quote_job(req: QuoteRequest, request: Request):
+    """Queue a quote and return its job ID straight away (for large moves)."""
+    client_rate_limiter.check(request, len(req.photo_urls))
+    job_id = job_store.create(req)
+    await job_queue.put(job_id)
+    print(f"[MOVCO] 📨 Queued job {job_id} ({len(req.photo_urls)} photo(s), "
+          f"{job_queue.qsize()} waiting)")
+    return build_job_status(job_store.get(job_id))
+
+
+async def persist_uploaded_photo(
+    data: bytes, content_type: str, path: str, result: Dict[str, Any]
+) -> None:
+    """
+    Save an /analyze_photo upload to Supabase Storage. Its analysis is already
+    in vision_cache under the image bytes, so /analyze on that URL reuses it.
+    """
+    try:
+        resp = await http_client.post(
+            f"{SUPABASE_URL}/storage/v1/object/{UPLOAD_BUCKET}/{path}",
+            content=data,
+            headers={"Authorization": f"Bearer {SUPABASE_SERVICE_KEY}", "Content-Type": content_type},
+            timeout=30,
+        )
+        resp.raise_for_status()
+    except Exception as e:
+        print(f"[MOVCO] ❌ Couldn't save uploaded photo {path}: {e}")
+        metrics.incr("upload_persist_failed")
+        return
+    url = f"{SUPABASE_URL}/storage/v1/object/public/{UPLOAD_BUCKET}/{path}"
+    metrics.incr("upload_persisted")
+    print(f"[MOVCO] 💾 Uploaded photo saved to {url[:80]}")
+
+
+@app.post("/analyze_photo")
+async def analyze_uploaded_photo(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    persist: bool = Form(True),
+):
+    """
+    Analyse one photo posted as multipart form data (field "file") straight
+    from the browser, with no storage round trip. Returns the per-photo shape
+    of analyze_room_with_claude: {"items": [{"label", "quantity",
+    "volume_ft3"}], "total_volume_ft3"}. If MOVCO_UPLOAD_BUCKET is configured
+    (and `persist` isn't false) the photo is saved there after responding and
+    its URL returned as "photo_url".
+    """
+    client_rate_limiter.check(request, 1)
+    content_type = (file.content_type or "").lower()
+    if not content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Upload an image file")
+    data = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Photo is too large")
+    vision_limiter.check_admission()
+
+    media_type = content_type if content_type in ("image/png", "image/webp", "image/gif") else "image/jpeg"
+    print(f"[MOVCO] 📤 Photo uploaded directly ({len(data)} bytes, {media_type})")
+    result = await analyze_room_with_claude(
+        None, image=(base64.b64encode(data).decode("utf-8"), media_type)
+    )
+    if result.get("failed"):
+        raise HTTPException(status_code=502, detail="Photo analysis failed, please try again")
+
+    if persist and UPLOAD_BUCKET and SUPABASE_URL and SUPABASE_SERVICE_KEY:
+        extension = media_type.split("/")[1].replace("jpeg", "jpg")
+        path = f"direct-uploads/{uuid.uuid4().hex}.{extension}"
+        background_tasks.add_task(persist_uploaded_photo, data, media_type, path, result)
+        result = dict(result, photo_url=f"{SUPABASE_URL}/storage/v1/object/public/{UPLOAD_BUCKET}/{path}")
+    return result
+
+
+@app.delete("/admin/vision-cache")
+async def purge_vision_cache(admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Drop every cached vision result, e.g. after a model or prompt regression."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not hmac.compare_digest(admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    purged = vision_cache.purge()
+    print(f"[MOVCO] 🧹 Vision cache purged ({purged} entries)")
+    return {"purged": purged}
+
+
+@app.post("/photos/ingest", status_code=202)
+async def ingest_photos(
+    payload: Dict[str, Any],
+    webhook_secret: Optional[str] = Header(None, alias="X-Webhook-Secret"),
+):
+    """
+    Pre-analyse photos as soon as they are uploaded (point the Supabase
+    storage webhook here, with X-Webhook-Secret). Returns straight away; the
+    results land in the caches that /analyze reads.
+    """
+    if not INGEST_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Photo ingest is disabled")
+    if not hmac.compare_digest(webhook_secret or "", INGEST_WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    urls = ingest_photo_urls(payload)
+    for url in urls:
+        start_prewarm(url)
+    metrics.incr("prewarm_requested", len(urls))
+    print(f"[MOVCO] 🔥 Pre-analysing {len(urls)} uploaded photo(s)")
+    return {"accepted": len(urls)}
+
+
+@app.post("/quotes/{analysis_id}/reprice", response_model=QuoteResponse)
+async def reprice_analysis(analysis_id: str, overrides: RepriceRequest):
+    """
+    Re-price a stored analysis (analysis_id from an /analyze response) with a
+    different move date, stairs, mover count or addresses. Vision isn't
+    re-run; distance is only looked up again if an address changed.
+    """
+    started = time.perf_counter()
+    analysis = analysis_store.get(analysis_id)
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    req = analysis["request"]
+    start = overrides.starting_address or req.starting_address
+    end = overrides.ending_address or req.ending_address
+    if (start, end) == (req.starting_address, req.ending_address):
+        distance_info = analysis["distance"]
+    else:
+        distance_info = await distance_flights.do(
+            address_flight_key(start, end), lambda: get_google_maps_distance(start, end)
+        )
+    distance_done = time.perf_counter()
+
+    print(f"[MOVCO] 💷 Re-pricing analysis {analysis_id}")
+    response = build_quote_response(
+        len(req.photo_urls),
+        analysis["items"],
+        analysis["total_volume_ft3"],
+        distance_info,
+        move_date=overrides.move_date,
+        stairs_flights=overrides.stairs_flights or 0,
+        movers_override=overrides.movers,
+    )
+    if analysis["tier"] != "full":
+        apply_tier_note(response, analysis["tier"], analysis["photos_analysed"], len(req.photo_urls))
+    # Still provisional/partial if re-analysis or the top-up job hasn't finished it yet
+    state = analysis["state"]
+    for field, value in state.items():
+        setattr(response, field, value)
+    if state.get("is_provisional"):
+        response.description += (
+            f" Provisional: {len(state.get('failed_photo_urls') or [])} photo(s) could not be "
+            f"analysed yet and are being retried; the quote will be updated."
+        )
+    if state.get("is_partial"):
+        response.description += (
+            f" Provisional: {len(state.get('pending_photo_urls') or [])} photo(s) are estimated "
+            f"and still being analysed."
+        )
+    finished = time.perf_counter()
+    response.analysis_id = analysis_id
+    response.stage_timings_ms = {
+        "distance": round((distance_done - started) * 1000, 1),
+        "pricing": round((finished - distance_done) * 1000, 1),
+        "total": round((finished - started) * 1000, 1),
+    }
+    metrics.incr("reprices")
+    return response
+
+
+@app.get("/analyze/jobs/{job_id}", response_model=QuoteJobStatus)
+async def get_quote_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return build_job_status(job)
+
+
 if __name__ == "__main__":
     import uvicorn
 
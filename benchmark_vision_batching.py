@@ -0,0 +1,93 @@
+# benchmark_vision_batching.py
+# Compares one vision call per photo against multi-image batched calls on the
+# same photos: wall-clock latency, input/output tokens, and the items found.
+# Calls the Anthropic API directly (needs ANTHROPIC_API_KEY), bypassing the
+# API's rate limiter, caches and hedging.
+#
+#   python benchmark_vision_batching.py https://.../room1.jpg https://.../room2.jpg ...
+#   python benchmark_vision_batching.py --batch-size 4 --rounds 3 photos...
+#
+# With MOVCO_VISION_URL_SOURCE=1 public Supabase URLs are sent by URL (as the
+# API then does); anything else is downloaded and preprocessed first, outside
+# the timed section.
+
+import argparse
+import asyncio
+import time
+
+import api
+
+
+async def image_source(url: str) -> dict:
+    if api.direct_image_url(url):
+        return {"type": "url", "url": url}
+    base64_image, media_type = await api.download_image_as_base64(url)
+    base64_image, media_type, _ = api.preprocess_image(base64_image, media_type, api.IMAGE_MAX_EDGE_PX)
+    return {"type": "base64", "media_type": media_type, "data": base64_image}
+
+
+async def timed_call(request: dict) -> tuple:
+    started = time.perf_counter()
+    message = await api.client.messages.create(**request)
+    return message, (time.perf_counter() - started) * 1000
+
+
+async def run_single(sources: list) -> dict:
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed_call(api.vision_request(source)) for source in sources))
+    return {
+        "wall_ms": (time.perf_counter() - started) * 1000,
+        "calls": len(results),
+        "input_tokens": sum(message.usage.input_tokens for message, _ in results),
+        "output_tokens": sum(message.usage.output_tokens for message, _ in results),
+        "items": [len(api.parse_vision_items(message.content[0].text)) for message, _ in results],
+    }
+
+
+async def run_batched(sources: list, batch_size: int) -> dict:
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed_call(api.batch_vision_request(batch)) for batch in batches))
+    items = []
+    for batch, (message, _) in zip(batches, results):
+        sections = api.split_batch_response(message.content[0].text, len(batch)) or {}
+        items += [len(api.parse_vision_items(sections[n])) if n in sections else None for n in range(1, len(batch) + 1)]
+    return {
+        "wall_ms": (time.perf_counter() - started) * 1000,
+        "calls": len(results),
+        "input_tokens": sum(message.usage.input_tokens for message, _ in results),
+        "output_tokens": sum(message.usage.output_tokens for message, _ in results),
+        "items": items,
+    }
+
+
+def report(label: str, runs: list) -> None:
+    n = len(runs)
+    print(f"[MOVCO] {label:<12} wall {sum(r['wall_ms'] for r in runs) / n:8.0f} ms   "
+          f"calls {runs[0]['calls']:3d}   "
+          f"input {sum(r['input_tokens'] for r in runs) / n:8.0f} tok   "
+          f"output {sum(r['output_tokens'] for r in runs) / n:6.0f} tok   "
+          f"items/photo {runs[-1]['items']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched vs per-photo vision calls")
+    parser.add_argument("photos", nargs="+", help="room photo URLs")
+    parser.add_argument("--batch-size", type=int, default=api.VISION_BATCH_SIZE if api.VISION_BATCH_SIZE > 1 else 4)
+    parser.add_argument("--rounds", type=int, default=1, help="runs of each mode to average")
+    args = parser.parse_args()
+    if not api.client:
+        raise SystemExit("ANTHROPIC_API_KEY is not set")
+
+    sources = [await image_source(url) for url in args.photos]
+    single, batched = [], []
+    for _ in range(args.rounds):
+        single.append(await run_single(sources))
+        batched.append(await run_batched(sources, args.batch_size))
+    report("per photo", single)
+    report(f"batch of {args.batch_size}", batched)
+    await api.http_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+import { NextResponse } from 'next/server';
+import { createClient } from '@supabase/supabase-js';
+
+const supabase = createClient(
+  process.env.NEXT_PUBLIC_SUPABASE_URL!,
+  process.env.SUPABASE_SERVICE_ROLE_KEY!
+);
+
+const MOVCO_API_URL = process.env.MOVCO_API_URL || 'https://movco-api.onrender.com';
+
+// Photo analysis routinely outlasts the default function timeout
+export const maxDuration = 300;
+
+// Dashboard quotes go through here so the API key that earns the "dashboard"
+// traffic class never reaches the browser. Every dashboard user leaves from the
+// same Vercel IP, so MOVCO_DASHBOARD_API_KEY must be set on the API in both
+// MOVCO_TRAFFIC_CLASS_KEYS ("dashboard=<key>") and MOVCO_RATE_LIMIT_API_KEYS
+// ("<key>=<photos per minute>"); the user id sent in X-Movco-Client-Id then
+// gives each signed-in user their own allowance under that key.
+export async function POST(req: Request) {
+  const token = req.headers.get('authorization')?.replace(/^Bearer\s+/i, '');
+  if (!token) {
+    return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
+  }
+  const { data: { user } } = await supabase.auth.getUser(token);
+  if (!user) {
+    return NextResponse.json({ error: 'Unauthorized' }, { status: 401 });
+  }
+
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  if (process.env.MOVCO_DASHBOARD_API_KEY) {
+    headers['X-Movco-Traffic-Class'] = 'dashboard';
+    headers['X-API-Key'] = process.env.MOVCO_DASHBOARD_API_KEY;
+    headers['X-Movco-Client-Id'] = user.id;
+  }
+
+  const response = await fetch(`${MOVCO_API_URL}/analyze`, {
+    method: 'POST',
+    headers,
+    body: await req.text(),
+  });
+  const forwarded: Record<string, string> = {
+    'Content-Type': response.headers.get('content-type') || 'application/json',
+  };
+  const retryAfter = response.headers.get('retry-after');
+  if (retryAfter) forwarded['Retry-After'] = retryAfter;
+  return new NextResponse(await response.text(), { status: response.status, headers: forwarded });
+}
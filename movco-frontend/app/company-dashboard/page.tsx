@@ -2203,9 +2203,10 @@ function QuoteBuilder({ company, onSave, onCancel, prefill, pdfBranding, pricing
       setUploadedUrls(urls);
       if (urls.length === 0) throw new Error('Failed to upload photos. Please try again.');
 
-      const response = await fetch('https://movco-api.onrender.com/analyze', {
+      const { data: { session } } = await supabase.auth.getSession();
+      const response = await fetch('/api/analyze-quote', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${session?.access_token ?? ''}` },
         body: JSON.stringify({ starting_address: movingFrom, ending_address: movingTo, photo_urls: urls }),
       });
 
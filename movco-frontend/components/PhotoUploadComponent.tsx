@@ -80,6 +80,9 @@ export default function PhotoUploadComponent() {
         uploadedUrls.push(urlData.publicUrl);
       }
 
+      // Pre-analysis is triggered server-side: a Supabase storage webhook on
+      // movco-photos posts each upload to the API's /photos/ingest
+
       // Use functional state update — this guarantees we append to the LATEST state
       setRooms((prev) =>
         prev.map((r) =>
@@ -6,20 +6,46 @@
 #   ✅ No pricing/van/mover calculation (storage uses unit matching in frontend)
 #   ✅ Simplified /analyze endpoint — returns volume + items only
 #   ✅ Kept SMTP email notification for storage leads
+#
+# Shared code: this service deploys from its own directory, so it can't import
+# the removals API. The helpers listed in tests/test_storage_api_sync.py
+# (single-flight, vision cache, image download/preprocessing, per-client rate
+# limiting, cache purge) are verbatim copies of ../api.py, which is the source
+# of truth: change them there, copy them here (only the log tag differs) and
+# run the tests, which fail while the two copies disagree.
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import requests
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import httpx
 import anthropic
+import asyncio
 import base64
+import hashlib
+import hmac
+import io
+import json
+import math
 import os
+import sqlite3
+import threading
+import time
 import traceback
 import smtplib
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it photos are sent as downloaded
+    Image = None
+    print("[MOVCO-STORAGE] WARNING: Pillow not installed - photos are sent to vision without "
+          "downscaling or recompression (pip install Pillow)")
+
 FT3_TO_M3 = 0.0283168  # cubic feet -> cubic metres
 
 # ---------------------------------------------------------------------------
@@ -37,16 +63,84 @@ else:
 # ---------------------------------------------------------------------------
 # Environment
 # ---------------------------------------------------------------------------
+# Max photos analysed at once per request (each one = image download + vision call).
+# These are coroutines on the event loop, not threads, so this only bounds
+# upstream fan-out per request.
+PHOTO_ANALYSIS_CONCURRENCY = max(1, int(os.getenv("MOVCO_PHOTO_CONCURRENCY", "6")))
+
+# Per-client rate limits on the analyze endpoints, in photos per minute (each
+# request costs one token per photo). Set MOVCO_RATE_LIMIT_API_KEYS to
+# "key=photos_per_minute,..." to give known clients (X-API-Key) their own
+# allowance (per end user if they send X-Movco-Client-Id); everyone else is
+# limited per IP. MOVCO_RATE_LIMIT_DB points all
+# workers at one SQLite file so they share buckets; unset = per-process memory.
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("MOVCO_RATE_LIMIT_IP_PER_MINUTE", "30"))
+RATE_LIMIT_IP_BURST = float(os.getenv("MOVCO_RATE_LIMIT_IP_BURST", "30"))
+RATE_LIMIT_API_KEYS = {
+    key.strip(): float(limit)
+    for key, _, limit in (
+        part.partition("=") for part in os.getenv("MOVCO_RATE_LIMIT_API_KEYS", "").split(",")
+    )
+    if key.strip()
+}
+RATE_LIMIT_DB_PATH = os.getenv("MOVCO_RATE_LIMIT_DB")
+# Proxies in front of us that append to X-Forwarded-For (Render: 1); 0 = use the socket peer
+TRUSTED_PROXY_HOPS = int(os.getenv("MOVCO_TRUSTED_PROXY_HOPS", "1"))
+
+# Persistent vision-result cache, content-addressed (image bytes + model + prompt).
+# Point both APIs at the same file to share it; MOVCO_ADMIN_TOKEN enables the
+# purge endpoint (X-Admin-Token).
+VISION_CACHE_DB_PATH = os.getenv("MOVCO_VISION_CACHE_DB", "movco_vision_cache.sqlite3")
+VISION_CACHE_TTL_SECONDS = float(os.getenv("MOVCO_VISION_CACHE_TTL_DAYS", "30")) * 86400
+VISION_CACHE_MAX_MB = float(os.getenv("MOVCO_VISION_CACHE_MAX_MB", "100"))
+ADMIN_TOKEN = os.getenv("MOVCO_ADMIN_TOKEN")
+
+# Photos are shrunk before vision: long edge (px; 1568 is where Claude itself
+# resizes, so there is no detection loss) and JPEG quality for the re-encode.
+# Photos already within the edge and under REENCODE_MIN_BYTES are sent as-is.
+IMAGE_MAX_EDGE_PX = int(os.getenv("MOVCO_IMAGE_MAX_EDGE_PX", "1568"))
+IMAGE_JPEG_QUALITY = int(os.getenv("MOVCO_IMAGE_JPEG_QUALITY", "85"))
+IMAGE_REENCODE_MIN_BYTES = int(os.getenv("MOVCO_IMAGE_REENCODE_MIN_KB", "500")) * 1024
+
+# Photo downloads are streamed: anything larger than this is abandoned mid-read
+MAX_IMAGE_BYTES = int(float(os.getenv("MOVCO_MAX_IMAGE_MB", "20")) * 1024 * 1024)
+IMAGE_CHUNK_BYTES = 64 * 1024
+
+# Opt-in (MOVCO_VISION_URL_SOURCE=1): public Supabase photos are handed to the
+# vision API as a URL to fetch itself, saving the download + base64 re-upload.
+# The trade-off: those photos skip our downscale/recompress and MAX_IMAGE_BYTES
+# cap, and are cached by URL rather than by content, so the same photo under
+# a new URL is analysed again. Signed/private URLs, or a URL the provider
+# can't fetch, always go through the download path.
+VISION_URL_SOURCE = os.getenv("MOVCO_VISION_URL_SOURCE", "0") == "1"
+# Only this project's Supabase objects are passed by URL (unset = any)
+SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
+
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 if not ANTHROPIC_API_KEY:
     print("[MOVCO-STORAGE] WARNING: ANTHROPIC_API_KEY not set - furniture detection will fail")
 else:
     print("[MOVCO-STORAGE] ✓ ANTHROPIC_API_KEY is configured")
 
-app = FastAPI()
-
 # Initialize Anthropic client
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else None
+
+# Shared async HTTP client for image downloads
+http_client = httpx.AsyncClient(
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await http_client.aclose()
+    if client:
+        await client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS setup
 app.add_middleware(
@@ -64,6 +158,45 @@ app.add_middleware(
 )
 
 
+# ---------- Metrics ----------
+
+class Metrics:
+    """
+    In-process counters, gauges and timing summaries, served as JSON on
+    /metrics. Per worker process — not aggregated across workers.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, float] = {}
+        self.summaries: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, amount: float = 1.0) -> None:
+        self.counters[name] += amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        summary = self.summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "summaries": {
+                name: {**s, "avg": round(s["sum"] / s["count"], 2) if s["count"] else 0.0}
+                for name, s in self.summaries.items()
+            },
+        }
+
+
+metrics = Metrics()
+
+
 @app.get("/health")
 def health():
     return {
@@ -74,6 +207,11 @@ def health():
     }
 
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+
 # ---------- Schemas ----------
 
 class AnalyzeRequest(BaseModel):
@@ -259,53 +397,202 @@ def normalise_supabase_url(url: str) -> str:
     return url
 
 
-def download_image_as_base64(url: str) -> tuple[str, str]:
+def direct_image_url(url: Optional[str]) -> Optional[str]:
+    """The URL itself if the vision API can fetch it directly (public Supabase object), else None."""
+    if not VISION_URL_SOURCE or not url or not url.startswith("https://"):
+        return None
+    if "/storage/v1/object/public/" not in url:
+        return None
+    if SUPABASE_URL and not url.startswith(SUPABASE_URL + "/"):
+        return None
+    return url
+
+
+class ImageRejected(ValueError):
+    """A photo URL that doesn't serve an acceptable image (too big, or not an image at all)."""
+
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+# Types that say nothing about the content (S3 and some CDNs label every
+# upload like this); the magic bytes decide instead
+GENERIC_CONTENT_TYPES = ("application/octet-stream", "binary/octet-stream")
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Media type from the file's magic bytes, or None for anything vision can't take."""
+    for signature, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def download_image_as_base64(url: str) -> tuple[str, str]:
+    """Stream the photo straight into its base64 form.
+
+    The body is read in chunks and encoded as it arrives into one buffer (sized
+    up front from Content-Length when the server sends it), so a photo is never
+    held as raw bytes, encoded bytes and a string all at once. Anything over
+    MAX_IMAGE_BYTES, or not an image, is rejected before the rest is read.
+    """
     fixed_url = normalise_supabase_url(url)
     print(f"[MOVCO-STORAGE] 📥 Downloading image from: {fixed_url[:80]}...")
-    resp = requests.get(fixed_url, timeout=15)
-    resp.raise_for_status()
-    content_type = resp.headers.get("content-type", "image/jpeg")
-    if "png" in content_type:
-        media_type = "image/png"
-    elif "webp" in content_type:
-        media_type = "image/webp"
-    elif "gif" in content_type:
-        media_type = "image/gif"
-    else:
-        media_type = "image/jpeg"
-    base64_image = base64.b64encode(resp.content).decode("utf-8")
-    print(f"[MOVCO-STORAGE] ✓ Image downloaded ({len(base64_image)} chars, {media_type})")
+    async with http_client.stream("GET", fixed_url, timeout=15) as resp:
+        resp.raise_for_status()
+        content_type = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type and not content_type.startswith("image/") and content_type not in GENERIC_CONTENT_TYPES:
+            raise ImageRejected(f"Not an image ({content_type})")
+        declared = int(resp.headers.get("content-length") or 0)
+        if declared > MAX_IMAGE_BYTES:
+            raise ImageRejected(f"Image is {declared} bytes (limit {MAX_IMAGE_BYTES})")
+
+        encoded = bytearray(4 * math.ceil(declared / 3))
+        written = received = 0
+        media_type = None
+        carry = b""
+        async for chunk in resp.aiter_bytes(IMAGE_CHUNK_BYTES):
+            received += len(chunk)
+            if received > MAX_IMAGE_BYTES:
+                raise ImageRejected(f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+            if carry:
+                chunk = carry + chunk
+            if media_type is None:
+                if len(chunk) < 12:
+                    carry = chunk
+                    continue
+                media_type = sniff_image_type(chunk[:12])
+                if media_type is None:
+                    raise ImageRejected("Not a JPEG, PNG, GIF or WebP image")
+            # base64 works in 3-byte groups; hold back the remainder for the next chunk
+            whole = len(chunk) - len(chunk) % 3
+            carry = chunk[whole:]
+            piece = base64.b64encode(chunk[:whole])
+            encoded[written:written + len(piece)] = piece
+            written += len(piece)
+
+    if media_type is None:
+        if not carry:
+            raise ImageRejected("Empty image")
+        media_type = sniff_image_type(carry[:12])
+        if media_type is None:
+            raise ImageRejected("Not a JPEG, PNG, GIF or WebP image")
+    if carry:
+        piece = base64.b64encode(carry)
+        encoded[written:written + len(piece)] = piece
+        written += len(piece)
+    del encoded[written:]
+    base64_image = encoded.decode("ascii")
+    print(f"[MOVCO-STORAGE] ✓ Image downloaded ({received} bytes, {media_type})")
     return base64_image, media_type
 
 
-def analyze_room_with_claude(image_url: str) -> Dict[str, Any]:
-    if not client:
-        print("[MOVCO-STORAGE] ❌ Anthropic client not initialized")
-        return {"items": [], "total_volume_ft3": 0.0}
-    try:
-        base64_image, media_type = download_image_as_base64(image_url)
-        print(f"[MOVCO-STORAGE] 🤖 Sending image to Claude Vision API...")
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Claude's image token estimate (w*h/750) after its own resize to a 1568 px long edge."""
+    scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+    return int(width * scale * height * scale / 750)
 
-        # No temperature set — uses default for natural variability
-        # which averages out to accurate storage estimates
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2048,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": base64_image,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": """Analyze this room photo for a storage company.
+
+def preprocess_image(
+    base64_image: str, media_type: str, max_edge: int
+) -> tuple[str, str, Dict[str, int]]:
+    """
+    Shrink a photo before it goes to vision: JPEG draft-mode decode (decodes
+    at 1/2, 1/4 or 1/8 scale directly), EXIF orientation applied, long edge
+    resized to `max_edge`, re-encoded as JPEG at IMAGE_JPEG_QUALITY. The
+    original is kept if that wouldn't make it smaller. Returns the image plus
+    bytes/tokens before and after.
+    """
+    data = base64.b64decode(base64_image)
+    if Image is None or media_type == "image/gif":
+        return base64_image, media_type, {}
+    img = Image.open(io.BytesIO(data))
+    before_size = img.size
+    orientation = img.getexif().get(0x0112, 1)  # EXIF Orientation tag; 1 = upright
+    if max(img.size) <= max_edge and orientation == 1 and len(data) <= IMAGE_REENCODE_MIN_BYTES:
+        tokens = estimate_image_tokens(*before_size)
+        return base64_image, media_type, {
+            "bytes_before": len(data), "bytes_after": len(data),
+            "tokens_before": tokens, "tokens_after": tokens,
+        }
+    img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    processed = out.getvalue()
+    if len(processed) >= len(data) and orientation == 1:
+        processed, media_type_after = data, media_type
+        after_size = before_size
+    else:
+        media_type_after = "image/jpeg"
+        after_size = img.size
+    savings = {
+        "bytes_before": len(data),
+        "bytes_after": len(processed),
+        "tokens_before": estimate_image_tokens(*before_size),
+        "tokens_after": estimate_image_tokens(*after_size),
+    }
+    metrics.incr("image_bytes_saved", savings["bytes_before"] - savings["bytes_after"])
+    metrics.incr("image_tokens_saved", savings["tokens_before"] - savings["tokens_after"])
+    return base64.b64encode(processed).decode("utf-8"), media_type_after, savings
+
+
+# ---------- In-flight request coalescing ----------
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent upstream calls: while a call for `key`
+    is in flight, later callers await the same task instead of starting
+    their own. The shared call is cancelled only once every caller waiting
+    on it has gone away.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, Dict[str, Any]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = {"task": asyncio.create_task(fn()), "waiters": 0}
+            self._calls[key] = entry
+            entry["task"].add_done_callback(lambda _: self._forget(key, entry))
+            metrics.incr(f"singleflight_{self.name}_calls")
+        else:
+            metrics.incr(f"singleflight_{self.name}_coalesced")
+        task = entry["task"]
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not task.done():
+                task.cancel()  # last interested caller left
+
+    def _forget(self, key: str, entry: Dict[str, Any]) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+
+def photo_flight_key(url: str) -> str:
+    return normalise_supabase_url(url.strip())
+
+
+vision_flights = SingleFlight("vision")
+
+
+# ---------- Persistent vision result cache ----------
+
+VISION_MODEL = "claude-sonnet-4-20250514"
+VISION_PROMPT = """Analyze this room photo for a storage company.
 
 Identify ALL furniture and items visible. Use ONLY simple standard names from this list where possible:
 sofa, 2-seater sofa, 3-seater sofa, armchair, bed, single bed, double bed, king bed, mattress, wardrobe, chest of drawers, bedside table, nightstand, dining table, dining chair, coffee table, desk, office chair, bookcase, bookshelf, tv, tv stand, sideboard, cabinet, washing machine, fridge, dishwasher, microwave, boxes, lamp, floor lamp, mirror, rug, plant, bicycle, treadmill, printer, monitor, curtains, headboard, dresser
@@ -321,45 +608,238 @@ Format your response EXACTLY as:
 - lamp (2)
 - curtains (1)
 
-Count everything visible that would need to be stored.""",
-                        },
-                    ],
-                }
-            ],
+Count everything visible that would need to be stored."""
+# Changes to the prompt change the version, so stale answers are never reused.
+# Bump VISION_PROMPT_LAYOUT when the prompt moves within the request (e.g. to a
+# system block): same text, different model input. Layout 2 retires answers
+# cached while the prompt was briefly sent as a system block.
+VISION_PROMPT_LAYOUT = 2
+VISION_PROMPT_VERSION = hashlib.sha256(
+    f"{VISION_PROMPT_LAYOUT}:{VISION_PROMPT}".encode()
+).hexdigest()[:12]
+
+
+class VisionCache:
+    """
+    SQLite cache of parsed vision answers ([{"label", "quantity"}]) keyed by
+    sha256(image bytes) + model + prompt version (or of the public URL, for
+    photos the provider fetched itself), so the same photo is only
+    analysed once however it reaches us. Volumes are not stored: they are
+    re-derived from FURNITURE_VOLUMES on every hit. Entries expire after
+    VISION_CACHE_TTL_SECONDS; past VISION_CACHE_MAX_MB the least recently
+    used go first.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS vision_cache (
+                    key TEXT PRIMARY KEY,
+                    result_json TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def key_for(base64_image: str, max_edge: Optional[int]) -> str:
+        digest = hashlib.sha256(base64.b64decode(base64_image)).hexdigest()
+        return f"{digest}:{VISION_MODEL}:{VISION_PROMPT_VERSION}:{max_edge or 'full'}"
+
+    @staticmethod
+    def key_for_url(url: str) -> str:
+        """Key for a photo the provider fetched by URL (never downloaded, so no bytes to hash)."""
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return f"url:{digest}:{VISION_MODEL}:{VISION_PROMPT_VERSION}:full"
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT result_json FROM vision_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE vision_cache SET last_used_at = ? WHERE key = ?", (now, key)
+                )
+        metrics.incr("vision_cache_hits" if row else "vision_cache_misses")
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, parsed: List[Dict[str, Any]]) -> None:
+        result_json = json.dumps(parsed)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vision_cache VALUES (?, ?, ?, ?, ?)",
+                (key, result_json, len(result_json), now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 1:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        evicted = self._conn.execute(
+            "DELETE FROM vision_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM vision_cache").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used rows until ~10% under the cap
+            excess = total - self.max_bytes * 0.9
+            for key, size in self._conn.execute(
+                "SELECT key, size FROM vision_cache ORDER BY last_used_at"
+            ).fetchall():
+                if excess <= 0:
+                    break
+                self._conn.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+                excess -= size
+                total -= size
+                evicted += 1
+        metrics.incr("vision_cache_evictions", evicted)
+        metrics.set_gauge("vision_cache_bytes", total)
+
+    def discard(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+
+    def purge(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM vision_cache").rowcount
+
+
+vision_cache = VisionCache(VISION_CACHE_DB_PATH, VISION_CACHE_TTL_SECONDS, VISION_CACHE_MAX_MB * 1024 * 1024)
+
+
+def parse_vision_items(response_text: str) -> List[Dict[str, Any]]:
+    """'- double bed (1)' lines -> [{"label": "double bed", "quantity": 1}, ...]"""
+    parsed = []
+    for line in response_text.split("\n"):
+        line = line.strip()
+        if not line or not line.startswith("-"):
+            continue
+        line = line[1:].strip()
+        if "(" in line and ")" in line:
+            item_name = line[: line.rfind("(")].strip()
+            quantity_str = line[line.rfind("(") + 1 : line.rfind(")")].strip()
+            try:
+                quantity = int(quantity_str)
+            except Exception:
+                quantity = 1
+        else:
+            item_name = line
+            quantity = 1
+        parsed.append({"label": item_name, "quantity": quantity})
+    return parsed
+
+
+def size_vision_items(parsed: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], float]:
+    """Attach volumes from FURNITURE_VOLUMES; returns (items, total_volume_ft3)."""
+    items = []
+    total_volume_ft3 = 0.0
+    for entry in parsed:
+        item_volume = estimate_item_volume(entry["label"]) * entry["quantity"]
+        items.append(
+            {
+                "label": entry["label"],
+                "quantity": entry["quantity"],
+                "volume_ft3": round(item_volume, 2),
+            }
+        )
+        total_volume_ft3 += item_volume
+    return items, total_volume_ft3
+
+
+def vision_request(source: Dict[str, str]) -> Dict[str, Any]:
+    """messages.create arguments for one photo, given its image source block."""
+    return dict(
+        model=VISION_MODEL,
+        max_tokens=2048,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", "source": source},
+                    {"type": "text", "text": VISION_PROMPT},
+                ],
+            }
+        ],
+    )
+
+
+async def analyze_room_by_url(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Vision on a public photo the provider fetches itself. None if it couldn't
+    fetch it (private bucket, missing object, too large), so the caller can
+    fall back to downloading the photo.
+    """
+    cache_key = VisionCache.key_for_url(url)
+    parsed = vision_cache.get(cache_key)
+    if parsed is None:
+        print(f"[MOVCO-STORAGE] 🤖 Sending image URL to Claude Vision API...")
+        try:
+            message = await client.messages.create(**vision_request({"type": "url", "url": url}))
+        except anthropic.BadRequestError as e:
+            print(f"[MOVCO-STORAGE] ↩️  Vision API couldn't use the photo URL ({e.message}) - downloading it instead")
+            metrics.incr("vision_url_fallbacks")
+            return None
+        response_text = message.content[0].text
+        print(f"[MOVCO-STORAGE] 🤖 Claude response:\n{response_text}\n")
+        parsed = parse_vision_items(response_text)
+        vision_cache.put(cache_key, parsed)
+    metrics.incr("vision_url_sources")
+    items, total_volume_ft3 = size_vision_items(parsed)
+    print(f"[MOVCO-STORAGE] ✓ Detected {len(items)} item types, total: {total_volume_ft3:.2f} ft³ (by URL)")
+    return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2)}
+
+
+async def analyze_room_with_claude(image_url: str) -> Dict[str, Any]:
+    if not client:
+        print("[MOVCO-STORAGE] ❌ Anthropic client not initialized")
+        return {"items": [], "total_volume_ft3": 0.0}
+    try:
+        source_url = direct_image_url(image_url)
+        if source_url:
+            result = await analyze_room_by_url(source_url)
+            if result is not None:
+                return result
+        base64_image, media_type = await download_image_as_base64(image_url)
+        cache_key = VisionCache.key_for(base64_image, None)
+        parsed = vision_cache.get(cache_key)
+        if parsed is not None:
+            items, total_volume_ft3 = size_vision_items(parsed)
+            print(f"[MOVCO-STORAGE] 💾 Vision cache hit: {len(items)} item types, total: {total_volume_ft3:.2f} ft³")
+            return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2)}
+        base64_image, media_type, savings = await asyncio.to_thread(
+            preprocess_image, base64_image, media_type, IMAGE_MAX_EDGE_PX
+        )
+        if savings:
+            print(f"[MOVCO-STORAGE] 🗜️  Image {savings['bytes_before'] // 1024} KB → {savings['bytes_after'] // 1024} KB, "
+                  f"~{savings['tokens_before']} → ~{savings['tokens_after']} tokens")
+        print(f"[MOVCO-STORAGE] 🤖 Sending image to Claude Vision API...")
+
+        # No temperature set — uses default for natural variability
+        # which averages out to accurate storage estimates
+        message = await client.messages.create(
+            **vision_request({"type": "base64", "media_type": media_type, "data": base64_image})
         )
         response_text = message.content[0].text
         print(f"[MOVCO-STORAGE] 🤖 Claude response:\n{response_text}\n")
 
-        items = []
-        total_volume_ft3 = 0.0
-        for line in response_text.split("\n"):
-            line = line.strip()
-            if not line or not line.startswith("-"):
-                continue
-            line = line[1:].strip()
-            if "(" in line and ")" in line:
-                item_name = line[: line.rfind("(")].strip()
-                quantity_str = line[line.rfind("(") + 1 : line.rfind(")")].strip()
-                try:
-                    quantity = int(quantity_str)
-                except Exception:
-                    quantity = 1
-            else:
-                item_name = line
-                quantity = 1
-            unit_volume = estimate_item_volume(item_name)
-            item_volume = unit_volume * quantity
-            items.append(
-                {
-                    "label": item_name,
-                    "quantity": quantity,
-                    "volume_ft3": round(item_volume, 2),
-                }
-            )
-            total_volume_ft3 += item_volume
+        parsed = parse_vision_items(response_text)
+        vision_cache.put(cache_key, parsed)
+        items, total_volume_ft3 = size_vision_items(parsed)
 
         print(f"[MOVCO-STORAGE] ✓ Detected {len(items)} item types, total: {total_volume_ft3:.2f} ft³")
-        return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2)}
+        return {"items": items, "total_volume_ft3": round(total_volume_ft3, 2), "preprocess": savings}
 
     except Exception as e:
         print(f"[MOVCO-STORAGE] ❌ Error analyzing with Claude: {e}")
@@ -367,6 +847,38 @@ Count everything visible that would need to be stored.""",
         return {"items": [], "total_volume_ft3": 0.0}
 
 
+async def analyze_photo_safely(
+    index: int,
+    total: int,
+    url: str,
+    limit: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    async with limit:
+        print(f"[MOVCO-STORAGE] 📸 Processing photo {index}/{total}")
+        try:
+            return await vision_flights.do(
+                photo_flight_key(url), lambda: analyze_room_with_claude(url)
+            )
+        except Exception as e:
+            print(f"[MOVCO-STORAGE] ❌ Error analyzing photo {index}: {e}")
+            traceback.print_exc()
+            return {"items": [], "total_volume_ft3": 0.0}
+
+
+async def analyze_photos(photo_urls: List[str]) -> List[Dict[str, Any]]:
+    """
+    Analyze all photos concurrently (bounded by PHOTO_ANALYSIS_CONCURRENCY).
+    Results come back in the same order as photo_urls; a failed photo
+    degrades to an empty result rather than failing the whole analysis.
+    """
+    total = len(photo_urls)
+    limit = asyncio.Semaphore(PHOTO_ANALYSIS_CONCURRENCY)
+    return list(await asyncio.gather(*(
+        analyze_photo_safely(i, total, url, limit)
+        for i, url in enumerate(photo_urls, 1)
+    )))
+
+
 def aggregate_items_and_volume(
     all_results: List[Dict[str, Any]],
 ) -> tuple[List[AiItem], float]:
@@ -408,25 +920,167 @@ def aggregate_items_and_volume(
     return items, total_volume_ft3
 
 
+# ---------- Per-client rate limiting ----------
+
+class ClientRateLimited(Exception):
+    """A client (IP or API key) is over its photo allowance."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory; least recently used keys are dropped first."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        """Take `cost` tokens; returns 0 on success, else seconds until they'd be available."""
+        now = time.time()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+        if not wait:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path: str, idle_seconds: float = 3600):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._takes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def take(self, key: str, cost: float, capacity: float, rate: float) -> float:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE: take the write lock up front so two workers can't both
+            # read the same balance and spend it twice
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (key, tokens, now)
+                )
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    self._conn.execute(
+                        "DELETE FROM rate_buckets WHERE updated_at < ?", (now - self.idle_seconds,)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+
+class ClientRateLimiter:
+    """
+    Per-client photo allowance, checked before any image is downloaded.
+    Requests with a configured X-API-Key draw from that key's bucket, split
+    per end user when the keyed client names one in X-Movco-Client-Id;
+    everything else draws from the caller's IP bucket.
+    """
+
+    def __init__(self, store, ip_per_minute: float, ip_burst: float, key_limits: Dict[str, float]):
+        self.store = store
+        self.ip_per_minute = ip_per_minute
+        self.ip_burst = ip_burst
+        self.key_limits = key_limits
+
+    @staticmethod
+    def client_ip(request: Request) -> str:
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if forwarded and TRUSTED_PROXY_HOPS > 0:
+            # Only the hops our own proxies appended can be trusted
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+        return request.client.host if request.client else "unknown"
+
+    def check(self, request: Request, photo_count: int) -> None:
+        api_key = request.headers.get("x-api-key")
+        if api_key and api_key in self.key_limits:
+            kind = "key"
+            bucket = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+            client_id = request.headers.get("x-movco-client-id", "").strip()
+            if client_id:
+                bucket += ":" + client_id[:64]
+            per_minute = burst = self.key_limits[api_key]
+        else:
+            kind = "ip"
+            bucket = "ip:" + self.client_ip(request)
+            per_minute, burst = self.ip_per_minute, self.ip_burst
+        if per_minute <= 0:
+            return
+        # A request bigger than the whole bucket can still get in once it is full
+        cost = min(max(1, photo_count), burst)
+        wait = self.store.take(bucket, cost, burst, per_minute / 60)
+        if wait:
+            metrics.incr("rate_limit_rejections")
+            metrics.incr(f"rate_limit_rejections_{kind}")
+            print(f"[MOVCO-STORAGE] 🚦 Rate limited {bucket} ({photo_count} photo(s)), retry in {wait:.0f}s")
+            raise ClientRateLimited(wait)
+
+
+client_rate_limiter = ClientRateLimiter(
+    SQLiteBucketStore(RATE_LIMIT_DB_PATH) if RATE_LIMIT_DB_PATH else MemoryBucketStore(),
+    RATE_LIMIT_IP_PER_MINUTE,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_API_KEYS,
+)
+
+
 # ---------- Main endpoint ----------
 
+@app.exception_handler(ClientRateLimited)
+async def client_rate_limited_handler(request: Request, exc: ClientRateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many photos analysed from this client, please retry later"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+@app.delete("/admin/vision-cache")
+async def purge_vision_cache(admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Drop every cached vision result, e.g. after a model or prompt regression."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if not hmac.compare_digest(admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    purged = vision_cache.purge()
+    print(f"[MOVCO-STORAGE] 🧹 Vision cache purged ({purged} entries)")
+    return {"purged": purged}
+
+
 @app.post("/analyze", response_model=AnalyzeResponse)
-def analyze_storage(req: AnalyzeRequest):
+async def analyze_storage(req: AnalyzeRequest, request: Request):
+    client_rate_limiter.check(request, len(req.photo_urls))
     print(f"\n[MOVCO-STORAGE] ========================================")
     print(f"[MOVCO-STORAGE] 🚀 Starting storage analysis of {len(req.photo_urls)} photo(s)")
     print(f"[MOVCO-STORAGE] ========================================\n")
 
-    # Analyze photos with Claude
-    all_results: List[Dict[str, Any]] = []
-    for i, url in enumerate(req.photo_urls, 1):
-        print(f"[MOVCO-STORAGE] 📸 Processing photo {i}/{len(req.photo_urls)}")
-        try:
-            result = analyze_room_with_claude(url)
-            all_results.append(result)
-        except Exception as e:
-            print(f"[MOVCO-STORAGE] ❌ Error analyzing photo {i}: {e}")
-            traceback.print_exc()
-            all_results.append({"items": [], "total_volume_ft3": 0.0})
+    # Analyze photos with Claude (concurrently, results kept in photo order)
+    all_results = await analyze_photos(req.photo_urls)
 
     # Aggregate items & calculate volume
     items, total_volume_ft3 = aggregate_items_and_volume(all_results)
@@ -0,0 +1,50 @@
+# send_ingest_webhook.py
+# Local stand-in for the Supabase storage webhook: posts "photo uploaded"
+# events to the API's /photos/ingest endpoint so the pre-analysis path can be
+# exercised without Supabase.
+#
+#   python send_ingest_webhook.py https://.../room1.jpg https://.../room2.jpg
+#   python send_ingest_webhook.py --bucket movco-photos room-photos/1_123_0.jpg
+#
+# With --bucket, arguments are object paths and the payload is shaped like a
+# Supabase database webhook on storage.objects (the API needs SUPABASE_URL).
+
+import argparse
+import os
+
+import httpx
+
+
+def build_payloads(args) -> list:
+    if args.bucket:
+        return [
+            {
+                "type": "INSERT",
+                "table": "objects",
+                "schema": "storage",
+                "record": {"bucket_id": args.bucket, "name": name},
+                "old_record": None,
+            }
+            for name in args.photos
+        ]
+    return [{"photo_url": url} for url in args.photos]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send photo-upload webhooks to the MOVCO API")
+    parser.add_argument("photos", nargs="+", help="photo URLs (or object paths with --bucket)")
+    parser.add_argument("--api", default="http://127.0.0.1:8000", help="API base URL")
+    parser.add_argument("--bucket", help="send Supabase storage.objects webhooks for this bucket")
+    parser.add_argument("--secret", default=os.getenv("MOVCO_INGEST_SECRET"),
+                        help="X-Webhook-Secret (defaults to $MOVCO_INGEST_SECRET)")
+    args = parser.parse_args()
+
+    headers = {"X-Webhook-Secret": args.secret} if args.secret else {}
+    with httpx.Client(timeout=10) as http:
+        for payload in build_payloads(args):
+            resp = http.post(f"{args.api}/photos/ingest", json=payload, headers=headers)
+            print(f"[MOVCO] {resp.status_code} {resp.text}")
+
+
+if __name__ == "__main__":
+    main()
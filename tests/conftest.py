@@ -0,0 +1,34 @@
+# Shared setup for the API tests: the API modules read their configuration
+# at import time, so point every file they write at a scratch directory and
+# give them a stand-in price model before either is imported.
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+import joblib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix="movco-tests-")
+
+joblib.dump({"stand_in": True}, os.path.join(SCRATCH, "model.joblib"))
+os.environ["MOVCO_MODEL_PATH"] = os.path.join(SCRATCH, "model.joblib")
+os.environ["MOVCO_JOBS_DB"] = os.path.join(SCRATCH, "jobs.sqlite3")
+os.environ["MOVCO_VISION_CACHE_DB"] = os.path.join(SCRATCH, "vision_cache.sqlite3")
+os.environ.pop("GOOGLE_MAPS_API_KEY", None)
+os.environ.pop("ANTHROPIC_API_KEY", None)  # tests never reach the real vision API
+
+sys.path.insert(0, ROOT)
+
+
+def load_storage_api():
+    """movco-storage-api/api.py as module "storage_api" (its directory isn't a package)."""
+    if "storage_api" not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            "storage_api", os.path.join(ROOT, "movco-storage-api", "api.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["storage_api"] = module  # so inspect can find its source
+        spec.loader.exec_module(module)
+    return sys.modules["storage_api"]
@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import os
+import tracemalloc
+
+import httpx
+import pytest
+
+import api
+from conftest import load_storage_api
+
+storage_api = load_storage_api()
+
+PHOTO = b"\xff\xd8\xff\xe0" + os.urandom(8 * 1024 * 1024)
+CHUNK = 64 * 1024
+
+
+def photo_server(body: bytes, content_type: str = "image/jpeg", send_length: bool = True) -> httpx.AsyncClient:
+    """A client whose every GET streams `body` back in 64 KB chunks."""
+
+    async def chunks():
+        for start in range(0, len(body), CHUNK):
+            yield body[start:start + CHUNK]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        headers = {"content-type": content_type}
+        if send_length:
+            headers["content-length"] = str(len(body))
+        return httpx.Response(200, headers=headers, content=chunks())
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.parametrize("module", [api, storage_api], ids=["removals", "storage"])
+@pytest.mark.parametrize("send_length", [True, False], ids=["content-length", "no-length"])
+def test_download_peak_memory_per_photo(monkeypatch, module, send_length):
+    monkeypatch.setattr(module, "http_client", photo_server(PHOTO, send_length=send_length))
+
+    tracemalloc.start()
+    try:
+        encoded, media_type = asyncio.run(module.download_image_as_base64("https://example.com/room.jpg"))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert media_type == "image/jpeg"
+    assert encoded == base64.b64encode(PHOTO).decode("ascii")
+    # The encode buffer plus the final str, and a few chunks in flight; the
+    # old path held raw bytes + encoded bytes + str (~2.75x the encoded size)
+    assert peak < 2.2 * len(encoded)
+
+
+@pytest.mark.parametrize("module", [api, storage_api], ids=["removals", "storage"])
+@pytest.mark.parametrize("send_length", [True, False], ids=["content-length", "no-length"])
+def test_download_over_size_cap_is_rejected(monkeypatch, module, send_length):
+    monkeypatch.setattr(module, "MAX_IMAGE_BYTES", 1024 * 1024)
+    monkeypatch.setattr(module, "http_client", photo_server(PHOTO, send_length=send_length))
+
+    with pytest.raises(module.ImageRejected):
+        asyncio.run(module.download_image_as_base64("https://example.com/room.jpg"))
+
+
+@pytest.mark.parametrize("content_type", ["binary/octet-stream", "application/octet-stream", ""])
+@pytest.mark.parametrize("module", [api, storage_api], ids=["removals", "storage"])
+def test_generic_content_type_is_sniffed(monkeypatch, module, content_type):
+    monkeypatch.setattr(module, "http_client", photo_server(PHOTO[:CHUNK], content_type=content_type))
+
+    encoded, media_type = asyncio.run(module.download_image_as_base64("https://example.com/room.jpg"))
+
+    assert media_type == "image/jpeg"
+    assert base64.b64decode(encoded) == PHOTO[:CHUNK]
+
+    monkeypatch.setattr(module, "http_client", photo_server(b"%PDF-1.7\n" + bytes(64), content_type=content_type))
+    with pytest.raises(module.ImageRejected):
+        asyncio.run(module.download_image_as_base64("https://example.com/room.jpg"))
+
+
+@pytest.mark.parametrize("module", [api, storage_api], ids=["removals", "storage"])
+def test_download_of_non_image_is_rejected(monkeypatch, module):
+    monkeypatch.setattr(module, "http_client", photo_server(b"<html></html>", content_type="text/html"))
+
+    with pytest.raises(module.ImageRejected):
+        asyncio.run(module.download_image_as_base64("https://example.com/room.jpg"))
@@ -0,0 +1,84 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import api
+
+
+def client_request(ip: str, headers: dict = None) -> Request:
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": raw, "client": (ip, 50000)})
+
+
+def test_photo_ingest_needs_the_webhook_secret(monkeypatch):
+    monkeypatch.setattr(api, "INGEST_WEBHOOK_SECRET", "hook-secret")
+    started = []
+    monkeypatch.setattr(api, "start_prewarm", started.append)
+    client = TestClient(api.app)
+    body = {"photo_urls": ["https://example.com/room1.jpg"]}
+
+    assert client.post("/photos/ingest", json=body).status_code == 401
+    assert client.post("/photos/ingest", json=body, headers={"X-Webhook-Secret": "guess"}).status_code == 401
+    assert started == []
+
+    accepted = client.post("/photos/ingest", json=body, headers={"X-Webhook-Secret": "hook-secret"})
+    assert accepted.status_code == 202
+    assert started == body["photo_urls"]
+
+
+def test_keyed_proxy_gets_an_allowance_per_end_user():
+    limiter = api.ClientRateLimiter(api.MemoryBucketStore(), 30, 30, {"dash-secret": 20})
+    vercel = "76.76.21.21"
+    alice = client_request(vercel, {"X-API-Key": "dash-secret", "X-Movco-Client-Id": "user-a"})
+    bob = client_request(vercel, {"X-API-Key": "dash-secret", "X-Movco-Client-Id": "user-b"})
+
+    limiter.check(alice, 20)
+    limiter.check(bob, 20)  # same proxy IP and key, but a different signed-in user
+    with pytest.raises(api.ClientRateLimited):
+        limiter.check(alice, 1)
+
+    # Without a configured key the client id is not trusted: one IP bucket
+    spoofed = [client_request("198.51.100.4", {"X-Movco-Client-Id": f"user-{i}"}) for i in range(2)]
+    limiter.check(spoofed[0], 30)
+    with pytest.raises(api.ClientRateLimited):
+        limiter.check(spoofed[1], 1)
+
+
+def test_traffic_class_needs_the_class_key(monkeypatch):
+    monkeypatch.setattr(api, "TRAFFIC_CLASS_KEYS", {"dashboard": "dash-secret"})
+
+    assert api.resolve_traffic_class("dashboard", "dash-secret") == "dashboard"
+    assert api.resolve_traffic_class("dashboard", None) == "public"
+    assert api.resolve_traffic_class("dashboard", "guess") == "public"
+    assert api.resolve_traffic_class("background", "dash-secret") == "public"  # no key configured
+    assert api.resolve_traffic_class(None, "dash-secret") == "public"
+
+
+def test_idempotent_retry_replays_without_spending_allowance(monkeypatch):
+    limiter = api.ClientRateLimiter(api.MemoryBucketStore(), 4, 4, {})
+    monkeypatch.setattr(api, "client_rate_limiter", limiter)
+    monkeypatch.setattr(api, "admit_quote", lambda: "full")
+    runs = []
+
+    async def fake_pipeline(req, tier="full"):
+        runs.append(tier)
+        return api.QuoteResponse(estimate=450.0, description="2 rooms", items=[], totalVolumeM3=4.0, totalAreaM2=2.0)
+
+    monkeypatch.setattr(api, "run_quote_pipeline", fake_pipeline)
+    body = {
+        "starting_address": "1 High Street, Leeds",
+        "ending_address": "2 Station Road, York",
+        "photo_urls": [f"https://example.com/room{i}.jpg" for i in range(1, 5)],
+    }
+    headers = {"Idempotency-Key": "retry-after-timeout"}
+    client = TestClient(api.app)
+
+    first = client.post("/analyze", json=body, headers=headers)
+    retry = client.post("/analyze", json=body, headers=headers)
+
+    assert first.status_code == 200
+    assert retry.status_code == 200  # the four photos were charged once, on the first call
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert len(runs) == 1
+    assert client.post("/analyze", json=body).status_code == 429
@@ -0,0 +1,112 @@
+import asyncio
+
+import api
+
+
+def quote_request(photos: int) -> api.QuoteRequest:
+    return api.QuoteRequest(
+        starting_address="1 High Street, Leeds",
+        ending_address="2 Station Road, York",
+        photo_urls=[f"https://example.com/room{i}.jpg" for i in range(1, photos + 1)],
+    )
+
+
+def room(volume: float, failed: bool = False):
+    if failed:
+        return api.failed_photo_result("vision call failed")
+    return {
+        "items": [{"name": "wardrobe", "quantity": 1, "volume_ft3": volume}],
+        "total_volume_ft3": volume,
+    }
+
+
+def test_sampled_tier_deferred_photo_reprices_with_estimate(monkeypatch):
+    """A sampled quote with a failed photo is re-priced, not stuck, once that photo is re-analysed."""
+    req = quote_request(4)
+    sampled = api.sample_photo_indices(4, api.DEGRADE_SAMPLE_FRACTION)
+    failing = sampled[-1]
+    outcomes = {i: room(40.0, failed=(i == failing)) for i in sampled}
+
+    async def fake_analyze_photo_cached(url, max_edge=None):
+        return outcomes[req.photo_urls.index(url) + 1]
+
+    monkeypatch.setattr(api, "analyze_photo_cached", fake_analyze_photo_cached)
+
+    response = asyncio.run(api.run_quote_pipeline(req, tier="sampled"))
+    assert response.is_provisional
+    job = api.job_store.get(response.quote_id)
+    assert job["tier"] == "sampled"
+    assert job["photo_results"].count(None) == 4 - len(sampled)
+
+    outcomes[failing] = room(40.0)
+    entry = next(
+        row for row in api.job_store._execute(
+            "SELECT * FROM reanalysis_queue WHERE job_id = ?", (response.quote_id,)
+        )
+    )
+    asyncio.run(api.reanalyze_photo(entry))
+
+    job = api.job_store.get(response.quote_id)
+    assert job["status"] == "completed"
+    assert not api.job_store._execute(
+        "SELECT * FROM reanalysis_queue WHERE job_id = ?", (response.quote_id,)
+    )
+    repriced = api.QuoteResponse.model_validate(job["result"])
+    assert not repriced.is_provisional
+    assert repriced.pricing_method.endswith("_sampled")
+    # Every analysed photo is 40 ft³, so the unsampled ones are estimated at 40 ft³ each too
+    assert repriced.totalVolumeM3 == round(4 * 40.0 * api.FT3_TO_M3, 2)
+    assert job["unanalysed_estimate_ft3"] == 40.0 * (4 - len(sampled))
+
+
+def test_reprice_keeps_provisional_state_until_reanalysis_finishes(monkeypatch):
+    req = quote_request(2)
+    outcomes = {1: room(40.0), 2: room(40.0, failed=True)}
+
+    async def fake_analyze_photo_cached(url, max_edge=None):
+        return outcomes[req.photo_urls.index(url) + 1]
+
+    monkeypatch.setattr(api, "analyze_photo_cached", fake_analyze_photo_cached)
+
+    response = asyncio.run(api.run_quote_pipeline(req))
+    repriced = asyncio.run(api.reprice_analysis(response.analysis_id, api.RepriceRequest(movers=3)))
+    assert repriced.is_provisional
+    assert repriced.failed_photo_urls == [req.photo_urls[1]]
+    assert repriced.quote_id == response.quote_id
+
+    outcomes[2] = room(40.0)
+    entry = api.job_store._execute(
+        "SELECT * FROM reanalysis_queue WHERE job_id = ?", (response.quote_id,)
+    )[0]
+    asyncio.run(api.reanalyze_photo(entry))
+
+    repriced = asyncio.run(api.reprice_analysis(response.analysis_id, api.RepriceRequest(movers=3)))
+    assert not repriced.is_provisional
+    assert repriced.totalVolumeM3 == round(80.0 * api.FT3_TO_M3, 2)
+
+
+def test_topup_job_updates_stored_analysis(monkeypatch):
+    req = quote_request(2).model_copy(update={"deadline_ms": 50})
+
+    async def fake_analyze_photo_cached(url, max_edge=None):
+        if url == req.photo_urls[1]:
+            await asyncio.sleep(0.2)  # still in flight at the deadline
+        return room(40.0)
+
+    monkeypatch.setattr(api, "analyze_photo_cached", fake_analyze_photo_cached)
+
+    async def quote_then_topup():
+        response = await api.run_quote_pipeline(req)
+        partial = await api.reprice_analysis(response.analysis_id, api.RepriceRequest())
+        await asyncio.gather(*api.topup_tasks)
+        job_id = api.job_queue.get_nowait()  # what a quote job worker picks up next
+        assert job_id == response.topup_job_id
+        await api.run_quote_job(job_id)
+        final = await api.reprice_analysis(response.analysis_id, api.RepriceRequest())
+        return response, partial, final
+
+    response, partial, final = asyncio.run(quote_then_topup())
+    assert response.is_partial
+    assert partial.is_partial and partial.pending_photo_urls == [req.photo_urls[1]]
+    assert not final.is_partial
+    assert final.totalVolumeM3 == round(80.0 * api.FT3_TO_M3, 2)
@@ -0,0 +1,58 @@
+import asyncio
+
+import api
+
+
+def test_interactive_traffic_overtakes_queued_background_work():
+    # 20 calls/s with an empty bucket: every caller has to queue
+    limiter = api.VisionRateLimiter(1200, 10_000_000, max_queue=50, max_wait_seconds=10)
+    limiter.request_tokens = 0
+    served = []
+
+    async def call(cls: str, name: str) -> None:
+        api.traffic_class.set(cls)
+        await limiter.acquire(1)
+        served.append(name)
+
+    async def contend():
+        background = [asyncio.create_task(call("background", f"job{i}")) for i in range(1, 5)]
+        await asyncio.sleep(0.01)  # the jobs are queued before anyone else turns up
+        dashboard = [asyncio.create_task(call("dashboard", f"dash{i}")) for i in range(1, 3)]
+        await asyncio.gather(*background, *dashboard)
+
+    asyncio.run(contend())
+
+    assert served == ["dash1", "dash2", "job1", "job2", "job3", "job4"]
+
+
+def test_circuit_breaker_opens_probes_and_closes_again():
+    breaker = api.CircuitBreaker("test_upstream", slow_call_ms=1000)
+    assert breaker.allow()
+
+    for _ in range(api.BREAKER_MIN_CALLS):
+        breaker.record(False, 50)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    breaker.opened_at -= api.BREAKER_OPEN_SECONDS  # the open period has run out
+    assert breaker.allow()       # one probe goes through...
+    assert breaker.state == "half_open"
+    assert not breaker.allow()   # ...and only one
+    breaker.record(False, 50)
+    assert breaker.state == "open"  # failed probe: open again
+
+    breaker.opened_at -= api.BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    breaker.record(True, 50)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+    assert breaker.status()["recent_calls"] == 0
+
+
+def test_circuit_breaker_opens_on_slow_calls():
+    breaker = api.CircuitBreaker("test_upstream", slow_call_ms=1000)
+
+    for _ in range(api.BREAKER_MIN_CALLS):
+        breaker.record(True, 5000)
+
+    assert breaker.state == "open"
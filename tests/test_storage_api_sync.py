@@ -0,0 +1,47 @@
+import inspect
+
+import pytest
+
+import api
+from conftest import load_storage_api
+
+# Helpers the storage API copies from the removals API (see the note at the
+# top of movco-storage-api/api.py). api.py is the source of truth.
+MIRRORED = [
+    "Metrics",
+    "normalise_supabase_url",
+    "direct_image_url",
+    "ImageRejected",
+    "sniff_image_type",
+    "download_image_as_base64",
+    "estimate_image_tokens",
+    "preprocess_image",
+    "SingleFlight",
+    "photo_flight_key",
+    "VisionCache",
+    "parse_vision_items",
+    "size_vision_items",
+    "vision_request",
+    "ClientRateLimited",
+    "MemoryBucketStore",
+    "SQLiteBucketStore",
+    "ClientRateLimiter",
+    "client_rate_limited_handler",
+    "purge_vision_cache",
+]
+MIRRORED_CONSTANTS = ["IMAGE_SIGNATURES", "GENERIC_CONTENT_TYPES", "IMAGE_CHUNK_BYTES"]
+
+
+storage_api = load_storage_api()
+
+
+@pytest.mark.parametrize("name", MIRRORED)
+def test_storage_api_copy_matches_removals_api(name):
+    source = inspect.getsource(getattr(api, name)).replace("[MOVCO] ", "[TAG] ")
+    copy = inspect.getsource(getattr(storage_api, name)).replace("[MOVCO-STORAGE] ", "[TAG] ")
+    assert copy == source, f"movco-storage-api/api.py:{name} has drifted from api.py:{name}"
+
+
+@pytest.mark.parametrize("name", MIRRORED_CONSTANTS)
+def test_storage_api_constants_match_removals_api(name):
+    assert getattr(storage_api, name) == getattr(api, name)
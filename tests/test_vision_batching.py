@@ -0,0 +1,102 @@
+import asyncio
+
+import api
+
+
+def photo(name: str) -> dict:
+    return {"type": "url", "url": f"https://example.com/{name}.jpg"}
+
+
+def test_split_batch_response_maps_sections_by_number():
+    answer = "## Photo 2\n- sofa (1)\n\n## Photo 1\n- double bed (1)\n- wardrobe (2)"
+
+    sections = api.split_batch_response(answer, 2)
+
+    assert api.parse_vision_items(sections[1]) == [
+        {"label": "double bed", "quantity": 1},
+        {"label": "wardrobe", "quantity": 2},
+    ]
+    assert api.parse_vision_items(sections[2]) == [{"label": "sofa", "quantity": 1}]
+
+
+def test_split_batch_response_leaves_out_a_missing_photo():
+    sections = api.split_batch_response("Photo 1:\n- sofa (1)\n**Photo 3**\n- desk (1)", 3)
+
+    assert sorted(sections) == [1, 3]
+
+
+def test_split_batch_response_rejects_ambiguous_numbering():
+    assert api.split_batch_response("## Photo 1\n- sofa (1)\n## Photo 1\n- desk (1)", 2) is None
+    assert api.split_batch_response("## Photo 1\n- sofa (1)\n## Photo 3\n- desk (1)", 2) is None
+    assert api.split_batch_response("- sofa (1)\n## Photo 1\n- desk (1)", 2) is None
+    # Malformed output with no headings at all leaves every photo unanswered
+    assert api.split_batch_response('[{"photo": 1, "items": ["sofa"]}]', 2) == {}
+
+
+def fake_vision(monkeypatch, batch_answer: str) -> list:
+    calls = []
+
+    async def vision_text(sources):
+        calls.append([source["url"] for source in sources])
+        if len(sources) == 1:
+            return f"- item from {sources[0]['url']} (1)"
+        return batch_answer
+
+    monkeypatch.setattr(api, "vision_text", vision_text)
+    return calls
+
+
+def test_batcher_asks_singly_for_photos_the_batch_answer_skipped(monkeypatch):
+    calls = fake_vision(monkeypatch, "## Photo 1\n- sofa (1)")
+    batcher = api.VisionBatcher(2, 1000)
+
+    async def describe_both():
+        return await asyncio.gather(batcher.describe(photo("a")), batcher.describe(photo("b")))
+
+    first, second = asyncio.run(describe_both())
+
+    assert first.strip() == "- sofa (1)"
+    assert second == "- item from https://example.com/b.jpg (1)"
+    assert calls == [["https://example.com/a.jpg", "https://example.com/b.jpg"], ["https://example.com/b.jpg"]]
+
+
+def test_batcher_never_hands_a_photo_another_photos_items(monkeypatch):
+    calls = fake_vision(monkeypatch, "## Photo 1\n- sofa (1)\n## Photo 1\n- desk (1)")
+    batcher = api.VisionBatcher(2, 1000)
+
+    async def describe_both():
+        return await asyncio.gather(batcher.describe(photo("a")), batcher.describe(photo("b")))
+
+    first, second = asyncio.run(describe_both())
+
+    assert first == "- item from https://example.com/a.jpg (1)"
+    assert second == "- item from https://example.com/b.jpg (1)"
+    assert len(calls) == 3
+
+
+def test_batcher_cancels_the_call_once_every_caller_has_left(monkeypatch):
+    cancelled = []
+
+    async def vision_text(sources):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(len(sources))
+            raise
+
+    monkeypatch.setattr(api, "vision_text", vision_text)
+    batcher = api.VisionBatcher(2, 1000)
+
+    async def leave_early():
+        callers = [asyncio.create_task(batcher.describe(photo(name))) for name in ("a", "b")]
+        await asyncio.sleep(0.01)  # batch is full and its call is in flight
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == []  # one caller is still waiting
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.gather(*batcher._running, return_exceptions=True)
+
+    asyncio.run(leave_early())
+
+    assert cancelled == [2]